@@ -0,0 +1,138 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Measures DataNode.add throughput of schema-discovery.py on a wide,
+# nested synthetic feed.
+#
+# for Python 2.7
+#
+#
+# For help:
+#
+# python benchmarks/datanode-add.py --help
+#
+# To compare two versions, point --script at each copy in turn:
+#
+# git show <rev>:schema-discovery.py > /tmp/old-schema-discovery.py
+# python benchmarks/datanode-add.py --script /tmp/old-schema-discovery.py
+# python benchmarks/datanode-add.py
+#
+# @copyright (C) SpaceCurve, Inc. 2015
+
+import os
+import sys
+import imp
+import json
+import time
+import random
+from optparse import OptionParser
+
+ScriptDir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def parse_args():
+    usage = 'usage: %prog [options]'
+    parser = OptionParser(usage=usage)
+    parser.add_option(
+        '--script',
+        dest='script',
+        metavar='<scriptPath>',
+        default=os.path.join(ScriptDir, 'schema-discovery.py'),
+        help='schema-discovery.py version to measure'
+        )
+    parser.add_option(
+        '-n',
+        '--records',
+        dest='records',
+        metavar='<numRecords>',
+        default=2000,
+        help='Number of synthetic records'
+        )
+    parser.add_option(
+        '-w',
+        '--width',
+        dest='width',
+        metavar='<numProperties>',
+        default=100,
+        help='Number of properties per record'
+        )
+    parser.add_option(
+        '-d',
+        '--depth',
+        dest='depth',
+        metavar='<nestingDepth>',
+        default=3,
+        help='Nesting depth of the embedded dicts'
+        )
+    parser.add_option(
+        '-r',
+        '--repeat',
+        dest='repeat',
+        metavar='<numRuns>',
+        default=3,
+        help='Number of timed runs; the best is reported'
+        )
+    (ctx, args) = parser.parse_args()
+    return ctx
+
+
+def MakeValue(rng, i):
+    k = i % 5
+    if k == 0:
+        return rng.randint(-1000, 1000)
+    if k == 1:
+        return rng.random() * 1000
+    if k == 2:
+        return u'v%i' % rng.randint(0, 100000)
+    if k == 3:
+        return rng.random() < 0.5
+    if rng.random() < 0.5:
+        return None
+    return rng.randint(0, 10)
+
+
+def MakeDict(rng, width, depth):
+    d = {}
+    for i in range(width):
+        d[u'p%03i' % i] = MakeValue(rng, i)
+    if depth > 0:
+        d[u'nested'] = MakeDict(rng, max(1, width // 4), depth - 1)
+    return d
+
+
+def MakeFeed(numRecords, width, depth):
+    """MakeFeed: decoded records, so only DataNode.add is measured"""
+
+    rng = random.Random(1)
+    feed = []
+    for i in range(numRecords):
+        feed.append(json.loads(json.dumps({
+            'type': 'Feature',
+            'properties': MakeDict(rng, width, depth),
+            'geometry': {'type': 'Point', 'coordinates': [rng.uniform(-180,
+                         180), rng.uniform(-90, 90)]},
+            })))
+    return feed
+
+
+if __name__ == '__main__':
+    ctx = parse_args()
+    sd = imp.load_source('schema_discovery', ctx.script)
+    feed = MakeFeed(int(ctx.records), int(ctx.width), int(ctx.depth))
+    best = None
+    stdout = sys.stdout
+    for r in range(int(ctx.repeat)):
+        RootNode = sd.DataNode('root')
+        sys.stdout = open(os.devnull, 'w')
+        try:
+            t0 = time.time()
+            for jsonObj in feed:
+                RootNode.add('bench', jsonObj)
+            elapsed = time.time() - t0
+        finally:
+            sys.stdout.close()
+            sys.stdout = stdout
+        if best == None or elapsed < best:
+            best = elapsed
+    print '%s: %i records x %s properties, depth %s: %.0f records/sec' \
+        % (ctx.script, len(feed), ctx.width, ctx.depth, len(feed) / best)
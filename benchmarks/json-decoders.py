@@ -0,0 +1,81 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Measures the JSON decoders schema-discovery.py can use on the first
+# lines of an input file.
+#
+# for Python 2.7
+#
+#
+# For help:
+#
+# python benchmarks/json-decoders.py --help
+#
+# @copyright (C) SpaceCurve, Inc. 2015
+
+import os
+import sys
+import imp
+import time
+from optparse import OptionParser
+
+ScriptDir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def parse_args():
+    usage = 'usage: %prog [options] <inputPathName>'
+    parser = OptionParser(usage=usage)
+    parser.add_option(
+        '--script',
+        dest='script',
+        metavar='<scriptPath>',
+        default=os.path.join(ScriptDir, 'schema-discovery.py'),
+        help='schema-discovery.py version whose decoders are measured'
+        )
+    parser.add_option(
+        '-n',
+        '--records',
+        dest='records',
+        metavar='<numRecords>',
+        default=10000,
+        help='Number of lines to decode'
+        )
+    parser.add_option(
+        '-r',
+        '--repeat',
+        dest='repeat',
+        metavar='<numRepeats>',
+        default=3,
+        help='Best of this many timed runs per decoder'
+        )
+    (ctx, args) = parser.parse_args()
+    if len(args) != 1:
+        parser.error('expected one input file')
+    return (ctx, args[0])
+
+
+if __name__ == '__main__':
+    (ctx, inpath) = parse_args()
+    sd = imp.load_source('schema_discovery', ctx.script)
+
+    lineLst = []
+    for line in sd.OpenLines(inpath):
+        lineLst.append(line)
+        if len(lineLst) >= int(ctx.records):
+            break
+    numBytes = sum([len(line) for line in lineLst])
+    print '%i records, %.1f MB from %s' % (len(lineLst), numBytes
+            / 1048576.0, inpath)
+
+    for (name, loads) in sd.JsonDecoders:
+        (sd.JsonDecoderName, sd.JsonLoads) = (name, loads)
+        best = None
+        for r in range(int(ctx.repeat)):
+            t0 = time.time()
+            for line in lineLst:
+                sd.DecodeLine(line)
+            seconds = time.time() - t0
+            if best == None or seconds < best:
+                best = seconds
+        print '%-10s %8.1f MB/s %10.0f records/s' % (name, numBytes
+                / 1048576.0 / best, len(lineLst) / best)
@@ -0,0 +1,319 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Writes a deterministic, line-delimited feed of synthetic SpaceCurve
+# style GeoJSON features for benchmarking.
+#
+# for Python 2.7
+#
+#
+# For help:
+#
+# python benchmarks/make-features.py --help
+#
+# The same options and seed always produce the same file, so feeds can
+# be regenerated instead of stored.
+#
+# @copyright (C) SpaceCurve, Inc. 2015
+
+import sys
+import json
+import math
+import random
+from optparse import OptionParser
+
+GeometryTypes = [
+    'Point',
+    'MultiPoint',
+    'LineString',
+    'MultiLineString',
+    'Polygon',
+    'MultiPolygon',
+    ]
+
+
+def parse_args():
+    usage = 'usage: %prog [options]'
+    parser = OptionParser(usage=usage)
+    parser.add_option(
+        '-o',
+        '--output_path',
+        dest='ofn',
+        metavar='<outputPathName>',
+        default=None,
+        help='Output file, stdout when not given'
+        )
+    parser.add_option(
+        '-n',
+        '--records',
+        dest='records',
+        metavar='<numRecords>',
+        default=10000,
+        help='Number of features'
+        )
+    parser.add_option(
+        '--seed',
+        dest='seed',
+        metavar='<seed>',
+        default=1,
+        help='Random seed'
+        )
+    parser.add_option(
+        '-w',
+        '--width',
+        dest='width',
+        metavar='<numProperties>',
+        default=20,
+        help='Number of scalar properties per feature'
+        )
+    parser.add_option(
+        '-d',
+        '--depth',
+        dest='depth',
+        metavar='<nestingDepth>',
+        default=0,
+        help='Nesting depth of embedded dicts under properties'
+        )
+    parser.add_option(
+        '--list_variety',
+        dest='list_variety',
+        metavar='<numElementSchemas>',
+        default=0,
+        help='Number of distinct element schemas in a list-of-dict property, 0 for no list'
+        )
+    parser.add_option(
+        '--null_density',
+        dest='null_density',
+        metavar='<fraction>',
+        default=0.0,
+        help='Fraction of property values that are null'
+        )
+    parser.add_option(
+        '--geometry_mix',
+        dest='geometry_mix',
+        metavar='<type:weight,...>',
+        default='Point',
+        help='Weighted geometry types, e.g. Point:4,Polygon:1. Types: %s'
+             % ', '.join(GeometryTypes)
+        )
+    parser.add_option(
+        '--vertices',
+        dest='vertices',
+        metavar='<numVertices>',
+        default=16,
+        help='Vertices per line or polygon ring'
+        )
+    parser.add_option(
+        '--parts',
+        dest='parts',
+        metavar='<numParts>',
+        default=3,
+        help='Parts per Multi* geometry'
+        )
+    parser.add_option(
+        '--hole_rate',
+        dest='hole_rate',
+        metavar='<fraction>',
+        default=0.0,
+        help='Fraction of polygons that get a hole'
+        )
+    parser.add_option(
+        '--query_results',
+        dest='query_results',
+        action='store_true',
+        default=False,
+        help='Wrap each feature as a SpaceCurve query result line, the input of sc-to-geojson.py'
+        )
+    (ctx, args) = parser.parse_args()
+    return ctx
+
+
+def ParseGeometryMix(mixStr):
+    """ParseGeometryMix: [(geometry type, weight)] from 'Point:4,Polygon:1'"""
+
+    mixLst = []
+    for item in mixStr.split(','):
+        if ':' in item:
+            (geoType, weight) = item.split(':')
+        else:
+            (geoType, weight) = (item, 1)
+        if not geoType in GeometryTypes:
+            raise ValueError('unknown geometry type %s' % geoType)
+        mixLst.append((geoType, float(weight)))
+    return mixLst
+
+
+class FeatureMaker(object):
+
+    """FeatureMaker: builds the features of one deterministic feed"""
+
+    def __init__(
+        self,
+        seed=1,
+        width=20,
+        depth=0,
+        listVariety=0,
+        nullDensity=0.0,
+        geometryMix=[('Point', 1.0)],
+        vertices=16,
+        parts=3,
+        holeRate=0.0,
+        ):
+        self.rng = random.Random(seed)
+        self.width = width
+        self.depth = depth
+        self.listVariety = listVariety
+        self.nullDensity = nullDensity
+        self.geometryMix = geometryMix
+        self.totalWeight = sum([w for (t, w) in geometryMix])
+        self.vertices = max(vertices, 4)
+        self.parts = max(parts, 1)
+        self.holeRate = holeRate
+
+    def Value(self, i):
+        rng = self.rng
+        if rng.random() < self.nullDensity:
+            return None
+        k = i % 5
+        if k == 0:
+            return rng.randint(-100000, 100000)
+        if k == 1:
+            return round(rng.uniform(-1000, 1000), 4)
+        if k == 2:
+            return u'v%i' % rng.randint(0, 100000)
+        if k == 3:
+            return rng.random() < 0.5
+        return u'%04i-%02i-%02iT%02i:%02i:%02iZ' % (
+            rng.randint(1990, 2015),
+            rng.randint(1, 12),
+            rng.randint(1, 28),
+            rng.randint(0, 23),
+            rng.randint(0, 59),
+            rng.randint(0, 59),
+            )
+
+    def Properties(self, width, depth):
+        d = {}
+        for i in range(width):
+            d[u'p%03i' % i] = self.Value(i)
+        if depth > 0:
+            d[u'nested'] = self.Properties(max(1, width // 4), depth
+                    - 1)
+        return d
+
+    def ListElements(self):
+        """ListElements: dicts whose key sets are drawn from listVariety distinct schemas"""
+
+        elemLst = []
+        for i in range(self.rng.randint(1, 4)):
+            variant = self.rng.randrange(self.listVariety)
+            elem = {u'kind': u'k%i' % variant}
+            for b in range(12):
+                if variant >> b & 1:
+                    elem[u'f%02i' % b] = self.Value(b)
+            elemLst.append(elem)
+        return elemLst
+
+    def Ring(self, lon, lat, radius, clockwise=False):
+        """Ring: a closed ring of self.vertices positions around (lon, lat)"""
+
+        n = self.vertices - 1
+        step = 2 * math.pi / n
+        if clockwise:
+            step = -step
+        ring = []
+        for i in range(n):
+            r = radius * self.rng.uniform(0.8, 1.0)
+            ring.append([round(lon + r * math.cos(i * step), 6),
+                        round(lat + r * math.sin(i * step), 6)])
+        ring.append(list(ring[0]))
+        return ring
+
+    def Polygon(self, lon, lat):
+        radius = self.rng.uniform(0.001, 0.1)
+        rings = [self.Ring(lon, lat, radius)]
+        if self.rng.random() < self.holeRate:
+            rings.append(self.Ring(lon, lat, radius / 3, clockwise=True))
+        return rings
+
+    def Line(self, lon, lat):
+        line = []
+        for i in range(self.vertices):
+            lon += self.rng.uniform(-0.01, 0.01)
+            lat += self.rng.uniform(-0.01, 0.01)
+            line.append([round(lon, 6), round(lat, 6)])
+        return line
+
+    def Geometry(self):
+        pick = self.rng.uniform(0, self.totalWeight)
+        for (geoType, weight) in self.geometryMix:
+            pick -= weight
+            if pick <= 0:
+                break
+        lon = self.rng.uniform(-179, 179)
+        lat = self.rng.uniform(-85, 85)
+        if geoType == 'Point':
+            coordinates = [round(lon, 6), round(lat, 6)]
+        elif geoType == 'MultiPoint':
+            coordinates = [[round(lon + self.rng.uniform(-0.1, 0.1), 6),
+                           round(lat + self.rng.uniform(-0.1, 0.1), 6)]
+                           for i in range(self.vertices)]
+        elif geoType == 'LineString':
+            coordinates = self.Line(lon, lat)
+        elif geoType == 'MultiLineString':
+            coordinates = [self.Line(lon + 0.2 * i, lat) for i in
+                           range(self.parts)]
+        elif geoType == 'Polygon':
+            coordinates = self.Polygon(lon, lat)
+        else:
+            coordinates = [self.Polygon(lon + 0.3 * i, lat) for i in
+                           range(self.parts)]
+        return {u'type': geoType, u'coordinates': coordinates}
+
+    def Feature(self, i):
+        properties = self.Properties(self.width, self.depth)
+        properties[u'id'] = i
+        if self.listVariety > 0:
+            properties[u'items'] = self.ListElements()
+        return {u'type': u'Feature', u'properties': properties,
+                u'geometry': self.Geometry()}
+
+
+def WriteFeatures(fp, numRecords, queryResults=False, **kwargs):
+    """WriteFeatures: writes numRecords features, one per line, returns the bytes written"""
+
+    maker = FeatureMaker(**kwargs)
+    nbytes = 0
+    for i in range(numRecords):
+        feature = maker.Feature(i)
+        if queryResults:
+            line = json.dumps([{u'rowid': i}, feature]) + '\n'
+        else:
+            line = json.dumps(feature) + '\n'
+        fp.write(line)
+        nbytes += len(line)
+    return nbytes
+
+
+if __name__ == '__main__':
+    ctx = parse_args()
+    if ctx.ofn:
+        fp = open(ctx.ofn, 'w')
+    else:
+        fp = sys.stdout
+    WriteFeatures(
+        fp,
+        int(ctx.records),
+        queryResults=ctx.query_results,
+        seed=int(ctx.seed),
+        width=int(ctx.width),
+        depth=int(ctx.depth),
+        listVariety=int(ctx.list_variety),
+        nullDensity=float(ctx.null_density),
+        geometryMix=ParseGeometryMix(ctx.geometry_mix),
+        vertices=int(ctx.vertices),
+        parts=int(ctx.parts),
+        holeRate=float(ctx.hole_rate),
+        )
+    if fp != sys.stdout:
+        fp.close()
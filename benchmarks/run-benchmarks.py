@@ -0,0 +1,266 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Times schema-discovery.py and sc-to-geojson.py on a fixed set of
+# synthetic feeds and appends the results to a JSON lines file, so runs
+# of different versions can be compared.
+#
+# for Python 2.7
+#
+#
+# For help:
+#
+# python benchmarks/run-benchmarks.py --help
+#
+# To compare with an older version:
+#
+# git show <rev>:schema-discovery.py > /tmp/old-schema-discovery.py
+# python benchmarks/run-benchmarks.py --label old --script /tmp/old-schema-discovery.py
+# python benchmarks/run-benchmarks.py --compare old
+#
+# @copyright (C) SpaceCurve, Inc. 2015
+
+import os
+import sys
+import imp
+import json
+import time
+import shutil
+import tempfile
+import platform
+import subprocess
+from optparse import OptionParser
+
+BenchDir = os.path.dirname(os.path.abspath(__file__))
+ScriptDir = os.path.dirname(BenchDir)
+
+# Workloads: name and make-features.py settings. Record counts are
+# multiplied by --scale.
+
+Workloads = [
+    ('flat-points', {'numRecords': 20000, 'width': 20}),
+    ('wide-nested', {'numRecords': 5000, 'width': 100, 'depth': 3}),
+    ('list-variety', {'numRecords': 10000, 'width': 10,
+     'listVariety': 256}),
+    ('sparse-nulls', {'numRecords': 20000, 'width': 40,
+     'nullDensity': 0.5}),
+    ('mixed-geometry', {'numRecords': 5000, 'width': 10,
+     'geometryMix': [
+        ('Point', 1.0),
+        ('MultiPoint', 1.0),
+        ('LineString', 1.0),
+        ('MultiLineString', 1.0),
+        ('Polygon', 1.0),
+        ('MultiPolygon', 1.0),
+        ], 'vertices': 64, 'holeRate': 0.3}),
+    ]
+
+
+def parse_args():
+    usage = 'usage: %prog [options]'
+    parser = OptionParser(usage=usage)
+    parser.add_option(
+        '--script',
+        dest='script',
+        metavar='<scriptPath>',
+        default=os.path.join(ScriptDir, 'schema-discovery.py'),
+        help='schema-discovery.py version to measure'
+        )
+    parser.add_option(
+        '--converter',
+        dest='converter',
+        metavar='<scriptPath>',
+        default=os.path.join(ScriptDir, 'sc-to-geojson.py'),
+        help='sc-to-geojson.py version to measure'
+        )
+    parser.add_option(
+        '--results',
+        dest='results',
+        metavar='<resultsPathName>',
+        default=os.path.join(BenchDir, 'results.jsonl'),
+        help='JSON lines file the results are appended to'
+        )
+    parser.add_option(
+        '--label',
+        dest='label',
+        metavar='<label>',
+        default=None,
+        help='Name of this run in the results, default the git revision'
+        )
+    parser.add_option(
+        '--compare',
+        dest='compare',
+        metavar='<label>',
+        default=None,
+        help='Print this run next to the latest results saved under label'
+        )
+    parser.add_option(
+        '-w',
+        '--workloads',
+        dest='workloads',
+        metavar='<name,...>',
+        default=','.join([name for (name, settings) in Workloads]),
+        help='Workloads to run'
+        )
+    parser.add_option(
+        '--scale',
+        dest='scale',
+        metavar='<factor>',
+        default=1.0,
+        help='Multiplies the record count of every workload'
+        )
+    parser.add_option(
+        '-r',
+        '--repeat',
+        dest='repeat',
+        metavar='<numRuns>',
+        default=3,
+        help='Number of timed runs; the best is reported'
+        )
+    (ctx, args) = parser.parse_args()
+    return ctx
+
+
+def GitRevision():
+    try:
+        return subprocess.check_output(['git', 'describe', '--always',
+                '--dirty'], cwd=ScriptDir,
+                stderr=open(os.devnull, 'w')).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def TimeCommand(command):
+    """TimeCommand: runs command, returns (seconds, peak RSS in KB, exit status)"""
+
+    devnull = open(os.devnull, 'w')
+    t0 = time.time()
+    proc = subprocess.Popen(command, stdout=devnull, stderr=devnull)
+    (pid, status, rusage) = os.wait4(proc.pid, 0)
+    seconds = time.time() - t0
+    proc.returncode = status
+    devnull.close()
+    peakRSS = rusage.ru_maxrss
+    if sys.platform == 'darwin':
+        peakRSS //= 1024  # bytes, not KB
+    return (seconds, peakRSS, status)
+
+
+def Measure(
+    label,
+    workload,
+    tool,
+    command,
+    numRecords,
+    nbytes,
+    repeat,
+    ):
+    """Measure: best of repeat runs of command as a result dict, None when it failed"""
+
+    best = None
+    for r in range(repeat):
+        (seconds, peakRSS, status) = TimeCommand(command)
+        if status != 0:
+            print '%-16s %-10s failed: %s' % (workload, tool,
+                    ' '.join(command))
+            return None
+        if best == None or seconds < best[0]:
+            best = (seconds, peakRSS)
+    (seconds, peakRSS) = best
+    return {
+        'label': label,
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'workload': workload,
+        'tool': tool,
+        'records': numRecords,
+        'bytes': nbytes,
+        'seconds': seconds,
+        'records_per_sec': numRecords / seconds,
+        'mb_per_sec': nbytes / 1048576.0 / seconds,
+        'peak_rss_kb': peakRSS,
+        'python': platform.python_version(),
+        'host': platform.node(),
+        }
+
+
+def LoadResults(resultsPath, label):
+    """LoadResults: the latest saved result of label for each (workload, tool)"""
+
+    resultDict = {}
+    if not os.path.exists(resultsPath):
+        return resultDict
+    for line in open(resultsPath):
+        result = json.loads(line)
+        if result['label'] == label:
+            resultDict[(result['workload'], result['tool'])] = result
+    return resultDict
+
+
+def PrintResult(result, baseline=None):
+    line = '%-16s %-10s %10.0f rec/s %8.2f MB/s %9i KB' % (result['workload'
+            ], result['tool'], result['records_per_sec'],
+            result['mb_per_sec'], result['peak_rss_kb'])
+    if baseline:
+        line += '   x%.2f speed, x%.2f memory vs %s' \
+            % (result['records_per_sec'] / baseline['records_per_sec'
+               ], result['peak_rss_kb'] / float(baseline['peak_rss_kb'
+               ]), baseline['label'])
+    print line
+
+
+if __name__ == '__main__':
+    ctx = parse_args()
+    mf = imp.load_source('make_features', os.path.join(BenchDir,
+                         'make-features.py'))
+    label = ctx.label or GitRevision()
+    baselineDict = {}
+    if ctx.compare:
+        baselineDict = LoadResults(ctx.results, ctx.compare)
+        if not baselineDict:
+            print 'No results saved under label %s in %s' \
+                % (ctx.compare, ctx.results)
+    workloadDict = dict(Workloads)
+    tmpDir = tempfile.mkdtemp(prefix='sd-bench-')
+    resultLst = []
+    try:
+        for name in ctx.workloads.split(','):
+            settings = dict(workloadDict[name])
+            numRecords = int(settings.pop('numRecords')
+                             * float(ctx.scale))
+            featurePath = os.path.join(tmpDir, '%s.json' % name)
+            fp = open(featurePath, 'w')
+            nbytes = mf.WriteFeatures(fp, numRecords, **settings)
+            fp.close()
+            resultPath = os.path.join(tmpDir, '%s-results.json' % name)
+            fp = open(resultPath, 'w')
+            resultBytes = mf.WriteFeatures(fp, numRecords,
+                    queryResults=True, **settings)
+            fp.close()
+            measureLst = [('discovery', [sys.executable, ctx.script,
+                          '-f', featurePath, '-t', 'bench', '-o',
+                          os.path.join(tmpDir, 'ddl.sql')], nbytes),
+                          ('conversion', [sys.executable,
+                          ctx.converter, '-i', resultPath, '-o',
+                          os.path.join(tmpDir, 'out.geojson')],
+                          resultBytes)]
+            for (tool, command, toolBytes) in measureLst:
+                result = Measure(
+                    label,
+                    name,
+                    tool,
+                    command,
+                    numRecords,
+                    toolBytes,
+                    int(ctx.repeat),
+                    )
+                if result:
+                    PrintResult(result, baselineDict.get((name, tool)))
+                    resultLst.append(result)
+    finally:
+        shutil.rmtree(tmpDir)
+    fp = open(ctx.results, 'a')
+    for result in resultLst:
+        fp.write(json.dumps(result, sort_keys=True) + '\n')
+    fp.close()
+    print '%i results saved as %s in %s' % (len(resultLst), label,
+            ctx.results)
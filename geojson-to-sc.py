@@ -0,0 +1,222 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Converts a standard GeoJSON FeatureCollection into line-delimited
+# features, the input format of SpaceCurve System and schema-discovery.py.
+#
+# for Python 2.7
+#
+#
+# For help:
+#
+# python geojson-to-sc.py --help
+#
+# and visit: https://github.com/SpaceCurve/schema-discovery
+#
+# Unlike jq --compact-output '.features[]', the FeatureCollection is never
+# loaded as a whole: it is scanned block by block and each feature is
+# written out as soon as its closing brace is seen, so memory use is
+# bounded by the largest feature. A JSON array of features is accepted
+# as well. schema-discovery.py --feature_collection reads
+# FeatureCollections through the same scanner.
+#
+# @copyright (C) SpaceCurve, Inc. 2015
+
+import re
+import sys
+from optparse import OptionParser
+
+BlockSize = 4 * 1024 * 1024
+
+# A JSON string, whose closing quote may not have been read yet, or a
+# bracket. Everything else is skipped by the regular expression engine.
+
+TokenPattern = re.compile(r'"[^"\\]*(?:\\.[^"\\]*)*(")?|[{}\[\]]')
+
+# Inside a feature only braces matter: coordinate brackets are skipped
+# along with everything else.
+
+BracePattern = re.compile(r'"[^"\\]*(?:\\.[^"\\]*)*(")?|[{}]')
+
+# Line breaks with the indentation around them. JSON strings cannot hold
+# a raw line break, so these are always between tokens.
+
+LineBreakPattern = re.compile(r'[ \t\r]*\n[ \t\r\n]*')
+WhiteSpace = ' \t\r\n'
+
+
+def parseargs():
+    """ Parse command line arguments """
+    parser = OptionParser()
+    parser.add_option('-i', '--in', dest = "in_file", type = "string", default = None, help = "name of the FeatureCollection file to convert, - for stdin")
+    parser.add_option('-o', '--out', dest = "out_file", type = "string", default = None, help = "name of the line-delimited output file, - for stdout")
+    opt, arg = parser.parse_args()
+    if not(opt.in_file and opt.out_file):
+        print "Error: must specify an --in and an --out file"
+        sys.exit(1)
+    return opt, arg
+
+
+class FeatureScanner:
+
+    """FeatureScanner: incremental scanner that cuts the features out of a FeatureCollection as blocks of it arrive"""
+
+    # The scanner tracks the nesting depth of the document. The
+    # "features" key of the top-level object, or a top-level array,
+    # opens the features array; each object directly inside it is a
+    # feature. Only the current feature, or a token cut by the end of a
+    # block, is kept between blocks.
+
+    def __init__(self):
+        self.buf = ''
+        self.pos = 0  # where scanning continues in buf
+        self.depth = 0
+        self.arrayDepth = None  # depth of the features array once found
+        self.featuresKey = False  # the last token was the "features" key
+        self.start = None  # start of the current feature in buf
+        self.braces = 0
+        self.done = False
+        self.count = 0
+
+    def feed(self, block):
+        """feed: scans the next block of the document, returns the features it completed as lines"""
+
+        lineLst = []
+        if self.done:
+            return lineLst
+        if self.start != None:
+            keep = self.start
+            self.start = 0
+        else:
+            keep = self.pos
+        self.buf = self.buf[keep:] + block
+        self.pos -= keep
+        buf = self.buf
+        pos = self.pos
+        while True:
+            if self.start != None:
+                m = BracePattern.search(buf, pos)
+                if m == None:
+                    pos = len(buf)
+                    break
+                tok = m.group()
+                if tok[0] == '"':
+                    if m.group(1) == None:
+                        pos = m.start()  # string continues in the next block
+                        break
+                elif tok == '{':
+                    self.braces += 1
+                else:
+                    self.braces -= 1
+                    if self.braces == 0:
+                        lineLst.append(LineBreakPattern.sub('',
+                                buf[self.start:m.end()]) + '\n')
+                        self.start = None
+                        self.depth -= 1
+                pos = m.end()
+                continue
+            m = TokenPattern.search(buf, pos)
+            if m == None:
+                pos = len(buf)
+                break
+            tok = m.group()
+            if tok[0] == '"':
+                if m.group(1) == None:
+                    pos = m.start()
+                    break
+                if self.depth == 1 and self.arrayDepth == None:
+
+                    # A key is followed by a colon, a value is not.
+
+                    after = m.end()
+                    while after < len(buf) and buf[after] in WhiteSpace:
+                        after += 1
+                    if after == len(buf):
+                        pos = m.start()  # decide once more has arrived
+                        break
+                    self.featuresKey = tok == '"features"' and buf[after] \
+                        == ':'
+                pos = m.end()
+                continue
+            if tok == '{' or tok == '[':
+                self.depth += 1
+                if self.arrayDepth == None:
+                    if tok == '[' and (self.depth == 1
+                            or self.featuresKey and self.depth == 2):
+                        self.arrayDepth = self.depth
+                elif tok == '{' and self.depth == self.arrayDepth + 1:
+                    self.start = m.start()
+                    self.braces = 1
+                    self.count += 1
+            else:
+                if self.depth == self.arrayDepth:
+                    self.done = True
+                    pos = m.end()
+                    break
+                self.depth -= 1
+            self.featuresKey = False
+            pos = m.end()
+        self.pos = pos
+        if self.done:
+            self.buf = ''
+            self.pos = 0
+        return lineLst
+
+    def close(self):
+        """close: checks that the whole features array was read"""
+
+        if self.arrayDepth == None:
+            raise ValueError('no FeatureCollection features array found')
+        if self.start != None:
+            raise ValueError('FeatureCollection ends inside feature %i'
+                             % self.count)
+        if not self.done:
+            raise ValueError('FeatureCollection ends inside the features array'
+                             )
+
+
+def ConvertFile(infh, outfh):
+    """ConvertFile: writes the features of the FeatureCollection in infh to outfh, one per line, returns their number"""
+
+    scanner = FeatureScanner()
+    count = 0
+    pendingLst = []
+    pendingBytes = 0
+    while True:
+        block = infh.read(BlockSize)
+        if not block:
+            break
+        for line in scanner.feed(block):
+            pendingLst.append(line)
+            pendingBytes += len(line)
+        if pendingBytes >= BlockSize:
+            outfh.write(''.join(pendingLst))
+            count += len(pendingLst)
+            pendingLst = []
+            pendingBytes = 0
+    scanner.close()
+    outfh.write(''.join(pendingLst))
+    return count + len(pendingLst)
+
+
+if __name__ == "__main__":
+    options, args = parseargs()
+    if options.in_file == '-':
+        infh = sys.stdin
+    else:
+        infh = open(options.in_file, 'rb')
+    if options.out_file == '-':
+        outfh = sys.stdout
+    else:
+        outfh = open(options.out_file, 'wb')
+    try:
+        count = ConvertFile(infh, outfh)
+    except ValueError, e:
+        sys.stderr.write('%s: %s\n' % (options.in_file, e))
+        sys.exit(1)
+    outfh.flush()
+    if outfh != sys.stdout:
+        outfh.close()
+    if infh != sys.stdin:
+        infh.close()
+    sys.stderr.write('%i features\n' % count)
@@ -12,39 +12,209 @@
 #
 # and visit: https://github.com/SpaceCurve/schema-discovery
 #
+# Each input line is a query result, [{row info}, {feature}]. The
+# features are written as one FeatureCollection. The input is read and
+# the output written in large blocks, so memory use does not grow with
+# the size of the result. With --jobs, a large input file is cut into
+# newline-aligned chunks that are converted in parallel.
+#
 # @copyright (C) SpaceCurve, Inc. 2015
 
 import os
-import re
 import sys
-import csv
+import json
+import shutil
+import tempfile
+import multiprocessing
+from optparse import OptionParser
 
-from optparse
-import OptionParser
+BlockSize = 4 * 1024 * 1024
+MinChunkBytes = 16 * 1024 * 1024  # files are not cut into smaller chunks
+Header = '{"type": "FeatureCollection", "features": [\r\n'
+Separator = ',\r\n'
+Footer = '] }'
+RowDecoder = json.JSONDecoder()
 
-linecleaner = re.compile('\[\{.+\},(\{.+\})\]')
 
 def parseargs():
     """ Parse command line arguments """
     parser = OptionParser()
-    parser.add_option('-i', '--in', dest = "in_file", type = "string", default = None, help = "name of input file to process")
-    parser.add_option('-o', '--out', dest = "out_file", type = "string", default = None, help = "name of output file to write")
+    parser.add_option('-i', '--in', dest = "in_file", type = "string", default = None, help = "name of input file to process, - for stdin")
+    parser.add_option('-o', '--out', dest = "out_file", type = "string", default = None, help = "name of output file to write, - for stdout")
+    parser.add_option('-j', '--jobs', dest = "jobs", type = "int", default = 1, help = "number of worker processes; input files larger than 16 MB are cut into chunks converted in parallel")
     opt, arg = parser.parse_args()
-    if not(opt.in_file or opt.out_file):
+    if not(opt.in_file and opt.out_file):
         print "Error: must specify an --in and an --out file"
         sys.exit(1)
+    if opt.jobs > 1 and opt.in_file == '-':
+        print "Error: --jobs needs an input file, not stdin"
+        sys.exit(1)
     return opt, arg
 
+
+def FeatureText(line):
+    """FeatureText: the feature of one query result line, the line itself when it is not a query result"""
+
+    # The row info is decoded to find where it ends; the feature is
+    # copied as it is, without decoding it.
+
+    line = line.strip()
+    if line[:1] == '[' and line[-1:] == ']':
+        start = len(line) - len(line[1:].lstrip())
+        try:
+            (rowInfo, end) = RowDecoder.raw_decode(line, start)
+        except ValueError:
+            return line
+        rest = line[end:-1].strip()
+        if isinstance(rowInfo, dict) and rest[:1] == ',':
+            return rest[1:].strip()
+    return line
+
+
+def LineBlocks(infh, start=0, end=None):
+    """LineBlocks: yields the lines of the byte range [start, end) of a file, one list per block read"""
+
+    # The range must start on a line boundary. A line longer than a
+    # block is carried over until its newline arrives.
+
+    if start:
+        infh.seek(start)
+    remaining = None
+    if end != None:
+        remaining = end - start
+    pieceLst = []
+    while remaining != 0:
+        size = BlockSize
+        if remaining != None:
+            size = min(size, remaining)
+        block = infh.read(size)
+        if not block:
+            break
+        if remaining != None:
+            remaining -= len(block)
+        pieceLst.append(block)
+        if not '\n' in block:
+            continue
+        lineLst = ''.join(pieceLst).split('\n')
+        pieceLst = [lineLst.pop()]
+        yield lineLst
+    tail = ''.join(pieceLst)
+    if tail:
+        yield [tail]
+
+
+def ConvertRange(infh, outfh, start=0, end=None):
+    """ConvertRange: writes the features of [start, end) of infh to outfh, separated but without a leading or trailing separator, returns their number"""
+
+    count = 0
+    for lineLst in LineBlocks(infh, start, end):
+        featureLst = [text for text in map(FeatureText, lineLst)
+                      if text]
+        if not featureLst:
+            continue
+        if count:
+            outfh.write(Separator)
+        outfh.write(Separator.join(featureLst))
+        count += len(featureLst)
+    return count
+
+
+def ConvertChunk(task):
+    """ConvertChunk: runs in a worker process, converts one byte range into a part file"""
+
+    (inpath, start, end, partpath) = task
+    infh = open(inpath, 'rb')
+    outfh = open(partpath, 'wb')
+    try:
+        return ConvertRange(infh, outfh, start, end)
+    finally:
+        infh.close()
+        outfh.close()
+
+
+def SplitFile(inpath, numChunks):
+    """SplitFile: cuts a file into at most numChunks byte ranges that start and end on newline boundaries"""
+
+    size = os.path.getsize(inpath)
+    offsetLst = [0]
+    fp = open(inpath, 'rb')
+    try:
+        for i in range(1, numChunks):
+            offset = max(size * i // numChunks, offsetLst[-1])
+            fp.seek(offset)
+            fp.readline()
+            offset = fp.tell()
+            if offset >= size:
+                break
+            if offset > offsetLst[-1]:
+                offsetLst.append(offset)
+    finally:
+        fp.close()
+    offsetLst.append(size)
+    return [(offsetLst[i], offsetLst[i + 1]) for i in
+            range(len(offsetLst) - 1)]
+
+
+def ConvertParallel(inpath, outfh, jobs, partDir):
+    """ConvertParallel: converts the chunks of inpath in a pool of worker processes, appending them to outfh in order"""
+
+    numChunks = min(jobs, max(1, os.path.getsize(inpath)
+                    // MinChunkBytes))
+    taskLst = []
+    for (start, end) in SplitFile(inpath, numChunks):
+        (fd, partpath) = tempfile.mkstemp(prefix='sc-to-geojson-',
+                suffix='.part', dir=partDir)
+        os.close(fd)
+        taskLst.append((inpath, start, end, partpath))
+    count = 0
+    pool = multiprocessing.Pool(processes=jobs)
+    try:
+        results = pool.imap(ConvertChunk, taskLst)
+        for task in taskLst:
+            partCount = results.next()
+            if partCount:
+                if count:
+                    outfh.write(Separator)
+                partfh = open(task[3], 'rb')
+                shutil.copyfileobj(partfh, outfh, BlockSize)
+                partfh.close()
+                count += partCount
+            os.remove(task[3])
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+        for task in taskLst:
+            if os.path.exists(task[3]):
+                os.remove(task[3])
+    return count
+
+
 if __name__ == "__main__":
     options, args = parseargs()
-    infh = open(options.in_file, 'r')
-    outfh = open(options.out_file, 'w')
-    outfh.write('{"type": "FeatureCollection", "features": [\r\n')
-    for line in infh.readlines():
-        m = linecleaner.match(line)
-        if m:
-            templine = m.groups()[0]
-        else:
-            templine = line.rstrip()
-        outfh.write(templine + ',\r\n')
-    outfh.write('] }')
+    if options.in_file == '-':
+        infh = sys.stdin
+    else:
+        infh = open(options.in_file, 'rb')
+    if options.out_file == '-':
+        outfh = sys.stdout
+        partDir = None
+    else:
+        outfh = open(options.out_file, 'wb', BlockSize)
+        partDir = os.path.dirname(os.path.abspath(options.out_file))
+    outfh.write(Header)
+    if options.jobs > 1:
+        count = ConvertParallel(options.in_file, outfh, options.jobs,
+                                partDir)
+    else:
+        count = ConvertRange(infh, outfh)
+    if count:
+        outfh.write('\r\n')
+    outfh.write(Footer)
+    outfh.flush()
+    if outfh != sys.stdout:
+        outfh.close()
+    if infh != sys.stdin:
+        infh.close()
@@ -16,12 +16,84 @@
 
 import os
 import sys
-import fileinput
 import json
+import glob
+import gzip
+import bz2
+import zlib
+import __builtin__
+import cPickle
+import cStringIO
+import copy_reg
+import hashlib
+import imp
+import struct
+import itertools
+import math
+import mmap
+import random
+import re
+import select
+import signal
+import stat
+import multiprocessing
+import subprocess
+import tempfile
+import threading
+import Queue
+import time
+from distutils.spawn import find_executable
 from optparse import OptionParser
 
 ImportedConvertToSupportedGeometry = True
 
+try:
+    import resource
+except ImportError:
+    resource = None
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Optional fast JSON decoders, fastest first. Each one is only offered
+# when it is installed; the stdlib json module is the last resort.
+
+JsonDecoders = []
+try:
+    import orjson
+    JsonDecoders.append(('orjson', orjson.loads))
+except ImportError:
+    pass
+try:
+    import simdjson
+    JsonDecoders.append(('simdjson', simdjson.loads))
+except ImportError:
+    pass
+try:
+    import ujson
+    JsonDecoders.append(('ujson', ujson.loads))
+except ImportError:
+    pass
+JsonDecoders.append(('json', json.loads))
+(JsonDecoderName, JsonLoads) = JsonDecoders[0]
+
+# In-process stream decompressors, used when no command line decompressor
+# is installed. xz needs the optional lzma module.
+
+StreamDecompressors = {'gz': lambda : zlib.decompressobj(16
+                       + zlib.MAX_WBITS), 'bz2': bz2.BZ2Decompressor}
+try:
+    import lzma
+    StreamDecompressors['xz'] = lzma.LZMADecompressor
+except ImportError:
+    try:
+        from backports import lzma
+        StreamDecompressors['xz'] = lzma.LZMADecompressor
+    except ImportError:
+        pass
+
 
 def parse_args():
     usage = 'usage: %prog [options]'
@@ -31,7 +103,7 @@ def parse_args():
         '--input_path',
         dest='ifn',
         metavar='<inputPathName>',
-        help='GeoJSON input filename, pathname, or partial path. Wildcards OK when all schemas match.'
+        help='GeoJSON input filename, pathname, or partial path. Wildcards OK when all schemas match. - or a named pipe is read as a stream'
         )
     parser.add_option(
         '-o',
@@ -79,7 +151,7 @@ def parse_args():
         action='store_true',
         metavar='<convert attributes_to_lowercase>',
         default=False,
-        help='Convert all attributes to lower case (implies data conversion)'
+        help='Convert all attributes to lower case, in the DDL and in the --clean_output file'
         )
     parser.add_option(
         '-v',
@@ -90,23 +162,521 @@ def parse_args():
         default=False,
         help='Show verbose log of tool activity'
         )
+    parser.add_option(
+        '-j',
+        '--jobs',
+        dest='jobs',
+        metavar='<numJobs>',
+        default=1,
+        help='Number of worker processes used to scan input files'
+        )
+    parser.add_option(
+        '--chunk_size',
+        dest='chunk_size',
+        metavar='<chunkSizeMB>',
+        default=64,
+        help='With --jobs, split input files larger than this many MB into newline-aligned byte ranges'
+        )
+    parser.add_option(
+        '--save_profile',
+        dest='save_profile',
+        metavar='<profilePath>',
+        default=None,
+        help='Save the profile state to this file at checkpoints and at the end of the run'
+        )
+    parser.add_option(
+        '--checkpoint_every',
+        dest='checkpoint_every',
+        metavar='<numRecords>',
+        default=None,
+        help='Checkpoint the profile state every n records'
+        )
+    parser.add_option(
+        '--watch',
+        dest='watch',
+        metavar='<seconds>',
+        default=None,
+        help='Keep polling the input files every n seconds, profiling appended lines and newly matching files, until interrupted'
+        )
+    parser.add_option(
+        '--ddl_every',
+        dest='ddl_every',
+        metavar='<numRecords>',
+        default=None,
+        help='With stream input, rewrite the DDL file every n records'
+        )
+    parser.add_option(
+        '--ddl_seconds',
+        dest='ddl_seconds',
+        metavar='<seconds>',
+        default=None,
+        help='With stream input, rewrite the DDL file when it is this many seconds behind the records read, 0 for never (default 10)'
+        )
+    parser.add_option(
+        '--resume',
+        dest='resume',
+        metavar='<profilePath>',
+        default=None,
+        help='Continue a run from the last checkpoint saved in this profile'
+        )
+    parser.add_option(
+        '--from_profile',
+        dest='from_profile',
+        metavar='<profilePath>',
+        default=None,
+        help='Generate DDL from a saved profile without reading any input'
+        )
+    parser.add_option(
+        '--cache_dir',
+        dest='cache_dir',
+        metavar='<cacheDir>',
+        default=None,
+        help='Keep the profile of every input file in this directory and reuse it while the file is unchanged'
+        )
+    parser.add_option(
+        '--cache_size',
+        dest='cache_size',
+        metavar='<sizeMB>',
+        default=1024,
+        help='Size limit of the profile cache, least recently used profiles are removed first'
+        )
+    parser.add_option(
+        '--converge_records',
+        dest='converge_records',
+        metavar='<numRecords>',
+        default=None,
+        help='Stop early once n records in a row add no new key path or type'
+        )
+    parser.add_option(
+        '--converge_bytes',
+        dest='converge_bytes',
+        metavar='<numMB>',
+        default=None,
+        help='Stop early once n MB of input in a row add no new key path or type'
+        )
+    parser.add_option(
+        '--sample_size',
+        dest='sample_size',
+        metavar='<numRecords>',
+        default=None,
+        help='Profile a uniform random sample of n records, spread over the input files in proportion to their size'
+        )
+    parser.add_option(
+        '--seed',
+        dest='seed',
+        metavar='<seed>',
+        default=None,
+        help='Random seed for --sample_size and --seek_sample, to reproduce a sample'
+        )
+    parser.add_option(
+        '--progress_every',
+        dest='progress_every',
+        metavar='<seconds>',
+        default=10,
+        help='Seconds between progress lines on stderr, 0 for none'
+        )
+    parser.add_option(
+        '--stats_json',
+        dest='stats_json',
+        metavar='<statsPathName>',
+        default=None,
+        help='Write throughput, per-stage timings, peak memory and node count of the run to this JSON file'
+        )
+    parser.add_option(
+        '--decoder',
+        dest='decoder',
+        metavar='<decoderName>',
+        default='auto',
+        help='JSON decoder: auto (fastest installed), %s' % ', '.join([name for (name, loads) in JsonDecoders])
+        )
+    parser.add_option(
+        '--cell_order',
+        dest='cell_order',
+        metavar='<order>',
+        default=10,
+        help='Resolution of the spatial density profile: a Hilbert curve of 2^order x 2^order cells over longitude/latitude'
+        )
+    parser.add_option(
+        '--unify_list_elements',
+        dest='unify_list_elements',
+        action='store_true',
+        metavar='<unify list elements>',
+        default=False,
+        help='Profile all dict elements of a list as one element schema with per-key presence counts'
+        )
+    parser.add_option(
+        '--no_sketches',
+        dest='no_sketches',
+        action='store_true',
+        default=False,
+        help='Skip the distinct counts, percentiles and most frequent values of numbers and strings, the most expensive statistics per value'
+        )
+    parser.add_option(
+        '--seek_sample',
+        dest='seek_sample',
+        metavar='<numRecords>',
+        default=None,
+        help='Profile the records found at n random byte offsets, spread over the input files in proportion to their size, without reading whole files'
+        )
+    parser.add_option(
+        '--offsets_path',
+        dest='offsets_path',
+        metavar='<offsetsPathName>',
+        default=None,
+        help='With --seek_sample, write the byte offsets used to this file'
+        )
+    parser.add_option(
+        '--feature_collection',
+        dest='feature_collection',
+        action='store_true',
+        default=False,
+        help='Input files are standard GeoJSON FeatureCollections, or JSON arrays of features, instead of one feature per line'
+        )
+    parser.add_option(
+        '--clean_output',
+        dest='clean_output',
+        metavar='<cleanPathName>',
+        default=None,
+        help='Also write every profiled record to this file, cleaned for ingestion: one record per line, repaired, height coordinates dropped and, with -a, keys in lower case'
+        )
     (ctx, args) = parser.parse_args()
 
     return (parser, ctx)
 
 
+# Schema change tracking: counts every new key path, type, value type and
+# geometry type discovered so far. Used by the convergence early stop.
+
+SchemaChanges = 0
+
+
+def NoteSchemaChange():
+    global SchemaChanges
+    SchemaChanges += 1
+
+
+# Distinct counts
+
+DistinctSketchBits = 12
+DistinctPowers = [2.0 ** -r for r in range(66)]
+DistinctMask = (1 << 64) - 1
+DistinctRankMask = (1 << 64 - DistinctSketchBits) - 1
+DistinctMultipliers = (0xbf58476d1ce4e5b9, 0x94d049bb133111eb)
+DistinctDouble = struct.Struct('<d')
+DistinctDoubleBits = struct.Struct('<q')
+SketchBatch = 256
+
+
+class distinctSketch(object):
+
+    """distinctSketch: HyperLogLog estimate of the number of distinct values added"""
+
+    # 2^DistinctSketchBits one-byte registers, 4 KB whatever the data,
+    # for a standard error of about 1.6%. Values are hashed with hash(),
+    # mixed into 64 bits since numbers hash to themselves. Fractional
+    # floats are hashed by their bit pattern instead: hash() of decimal
+    # data such as i * 0.01 collides on about a third of the values.
+    # Integral floats keep hash(), so 1 and 1.0 count once. Python 2 hashes
+    # strings and numbers the same in every process unless hash
+    # randomization (-R, PYTHONHASHSEED) is on, so sketches of worker
+    # processes and saved profiles merge correctly.
+
+    __slots__ = ('registers', )
+
+    def __init__(self):
+        self.registers = bytearray(1 << DistinctSketchBits)
+
+    def AddLst(self, valLst):
+        """AddLst: adds the values of valLst, each distinct value once"""
+
+        registers = self.registers
+        (m0, m1) = DistinctMultipliers
+        mask = DistinctMask
+        rankMask = DistinctRankMask
+        shift = 64 - DistinctSketchBits
+        for val in set(valLst):
+            h = hash(val)
+            if h != val:
+                if h == -2 and val == -1:
+                    h = -1  # hash(-1) is -2, like hash(-2)
+                elif type(val) is float:
+                    h = DistinctDoubleBits.unpack(DistinctDouble.pack(val))[0]
+            h = h * m0 & mask
+            h = (h ^ h >> 31) * m1 & mask
+            rank = shift + 1 - (h & rankMask).bit_length()
+            if registers[h >> shift] < rank:
+                registers[h >> shift] = rank
+
+    def merge(self, other):
+        self.registers = bytearray(map(max, self.registers,
+                                   other.registers))
+
+    def Estimate(self):
+        m = len(self.registers)
+        zeros = self.registers.count('\x00')
+        e = 0.7213 / (1 + 1.079 / m) * m * m \
+            / sum(map(DistinctPowers.__getitem__, self.registers))
+        if e <= 2.5 * m and zeros > 0:
+            e = m * math.log(float(m) / zeros)  # linear counting
+        return int(round(e))
+
+    def export(self, n):
+        """export: the estimated distinct count, at most n, and its ratio to n"""
+
+        d = min(self.Estimate(), n)
+        return 'distinct~%i (%.2f)' % (d, float(d) / max(n, 1))
+
+
+# Quantiles
+
+QuantileAccuracy = 0.01
+QuantileSubBuckets = int(math.ceil(0.5 / QuantileAccuracy))
+MaxQuantileBuckets = 2880
+ReportedQuantiles = [('p50', 0.5), ('p95', 0.95), ('p99', 0.99),
+                     ('p99.9', 0.999)]
+QuantileScale = 2 * QuantileSubBuckets
+MaxQuantileKey = (sys.float_info.max_exp + 2) * QuantileSubBuckets
+
+
+def QuantileValue(k):
+    """QuantileValue: the value reported for bucket k, within QuantileAccuracy of all values in it"""
+
+    if k >= MaxQuantileKey:
+        return sys.float_info.max
+    (e, j) = divmod(k, QuantileSubBuckets)
+    j += QuantileSubBuckets
+    # the bucket is [j, j + 1) / (2 * QuantileSubBuckets) * 2**(e - 1);
+    # report the point with equal relative error to both ends
+    return math.ldexp(float(j * (j + 1))
+                      / ((2 * j + 1) * QuantileSubBuckets), e - 1)
+
+
+class quantileSketch(object):
+
+    """quantileSketch: quantiles within QuantileAccuracy relative error, from logarithmic buckets"""
+
+    # A DDSketch with the log replaced by frexp: value x > 0 has mantissa
+    # m in [0.5, 1) and exponent e, and is counted in bucket
+    # e * QuantileSubBuckets + int(m * 2 * QuantileSubBuckets), so each
+    # power of two is cut into QuantileSubBuckets equal slices. The widest
+    # slice relative to its values is the first, at 1 / QuantileSubBuckets,
+    # which keeps the reported value within QuantileAccuracy. Negative
+    # values are counted by their magnitude in a second set of buckets.
+    # Merging adds counts, so the result does not depend on the order of
+    # values or of merges. Memory is bounded by MaxQuantileBuckets per
+    # sign, enough for a range of 17 orders of magnitude; past that the
+    # smallest magnitudes are folded together. --no_sketches skips it.
+
+    __slots__ = ('positive', 'negative', 'zeros', 'n')
+
+    def __init__(self):
+        self.positive = {}
+        self.negative = {}
+        self.zeros = 0
+        self.n = 0
+
+    def AddLst(self, valLst):
+        """AddLst: adds the values of valLst, bucketing each run of equal values once"""
+
+        # The values are sorted so that equal values are adjacent; a
+        # repeat adds to the bucket of the value before it. Zeros and
+        # NaN get buckets None, and NaN is never equal to the value
+        # before it.
+
+        frexp = math.frexp
+        prev = None
+        buckets = None
+        k = None
+        n = 0
+        for val in sorted(valLst):
+            if val != prev:
+                prev = val
+                if val > 1e-300:
+                    buckets = self.positive
+                elif val < -1e-300:
+                    buckets = self.negative
+                    val = -val
+                else:
+                    buckets = None
+                    if val != val:
+                        continue  # NaN
+                if buckets is not None:
+                    (m, e) = frexp(val)
+                    try:
+                        k = e * QuantileSubBuckets + int(m * QuantileScale)
+                    except OverflowError:
+                        k = MaxQuantileKey  # infinity
+            n += 1
+            if buckets is None:
+                self.zeros += 1
+            elif k in buckets:
+                buckets[k] += 1
+            else:
+                buckets[k] = 1
+        self.n += n
+        for buckets in (self.positive, self.negative):
+            if len(buckets) > MaxQuantileBuckets:
+                self.Collapse(buckets)
+
+    def Collapse(self, buckets):
+        keyLst = sorted(buckets.keys())
+        keep = keyLst[len(keyLst) - MaxQuantileBuckets]
+        for k in keyLst[:len(keyLst) - MaxQuantileBuckets]:
+            buckets[keep] += buckets.pop(k)
+
+    def merge(self, other):
+        for (mine, theirs) in [(self.positive, other.positive),
+                               (self.negative, other.negative)]:
+            for (k, count) in theirs.iteritems():
+                mine[k] = mine.get(k, 0) + count
+            if len(mine) > MaxQuantileBuckets:
+                self.Collapse(mine)
+        self.zeros += other.zeros
+        self.n += other.n
+
+    def Quantile(self, q):
+        """Quantile: the value of rank q * (n - 1) in sorted order, None when empty"""
+
+        if self.n == 0:
+            return None
+        rank = q * (self.n - 1)
+        seen = 0
+        for k in sorted(self.negative.keys(), reverse=True):
+            seen += self.negative[k]
+            if seen > rank:
+                return -QuantileValue(k)
+        seen += self.zeros
+        if seen > rank:
+            return 0.0
+        for k in sorted(self.positive.keys()):
+            seen += self.positive[k]
+            if seen > rank:
+                return QuantileValue(k)
+        return QuantileValue(max(self.positive.keys()))
+
+    def export(self, low, high, fmt):
+        """export: the ReportedQuantiles, clamped to [low, high] and formatted with fmt"""
+
+        qLst = []
+        for (name, q) in ReportedQuantiles:
+            val = min(max(self.Quantile(q), low), high)
+            if fmt == '%i':
+                val = round(val)  # bucket values are within 1%, not exact
+            qLst.append(('%s=' + fmt) % (name, val))
+        return ' '.join(qLst)
+
+
+# Frequent values
+
+TopKCapacity = 64
+TopKReported = 5
+TopKValueLength = 64
+CategoricalMaxValues = 16
+
+
+class topKSummary(object):
+
+    """topKSummary: Space-Saving summary of the most frequent values, with error bounds"""
+
+    # Holds at most 2 * TopKCapacity counters; when full it keeps the
+    # TopKCapacity largest. floor is the largest count dropped so far: a
+    # value not held has occurred at most floor times, so a value that
+    # (re)enters starts at floor + 1 with error floor. A held count c with
+    # error e means the value occurred between c - e and c times. With
+    # floor == 0 every count is exact. Values are compared on their first
+    # TopKValueLength characters. Which values are held once the summary
+    # overflowed depends on the order of the values, so export only lists
+    # those whose lower bound clears floor: those are held whatever the
+    # order or the merges that led here.
+
+    __slots__ = ('counts', 'errors', 'floor')
+
+    def __init__(self):
+        self.counts = {}
+        self.errors = {}
+        self.floor = 0
+
+    def AddLst(self, valLst):
+        """AddLst: adds the values of valLst, in order"""
+
+        counts = self.counts
+        for val in valLst:
+            val = val[:TopKValueLength]
+            if val in counts:
+                counts[val] += 1
+                continue
+            counts[val] = self.floor + 1
+            if self.floor:
+                self.errors[val] = self.floor
+            if len(counts) > 2 * TopKCapacity:
+                self.Prune()
+
+    def Prune(self):
+        keyLst = sorted(self.counts.keys(), key=lambda v: \
+                        (-self.counts[v], v))
+        for val in keyLst[TopKCapacity:]:
+            self.floor = max(self.floor, self.counts.pop(val))
+            self.errors.pop(val, None)
+
+    def merge(self, other):
+        counts = {}
+        errors = {}
+        for val in sorted(set(self.counts.keys())
+                          | set(other.counts.keys())):
+            counts[val] = self.counts.get(val, self.floor) \
+                + other.counts.get(val, other.floor)
+            error = self.errors.get(val, self.floor * (not val
+                                    in self.counts)) \
+                + other.errors.get(val, other.floor * (not val
+                                   in other.counts))
+            if error:
+                errors[val] = error
+        self.counts = counts
+        self.errors = errors
+        self.floor += other.floor
+        if len(self.counts) > 2 * TopKCapacity:
+            self.Prune()
+
+    def Exact(self):
+        """Exact: True when every distinct value is held with its exact count"""
+
+        return self.floor == 0
+
+    def export(self, n):
+        """export: the TopKReported most frequent values with their share of n"""
+
+        keyLst = sorted(self.counts.keys(), key=lambda v: \
+                        (-self.counts[v], v))
+        if self.floor:
+            keyLst = [v for v in keyLst if self.counts[v]
+                      - self.errors.get(v, 0) > self.floor]
+        keyLst = keyLst[:TopKReported]
+        topLst = []
+        for val in keyLst:
+            topStr = '%s %.1f%%' % (json.dumps(val), 100.0
+                                    * self.counts[val] / max(n, 1))
+            if val in self.errors:
+                topStr += '(-%.1f%%)' % (100.0 * self.errors[val]
+                        / max(n, 1))
+            topLst.append(topStr)
+        return 'top: %s' % (', '.join(topLst) or '-')
+
+
 # Type/Value Histograms
 
-class OneLineHisto:
+class OneLineHisto(object):
 
     """OneLineHisto: depending on the data type, this class gives you a snapshot of the data"""
 
+    __slots__ = ('sum', 'n', 'dataTypeDict')
+
     def __init__(self):
         self.sum = 0
         self.n = 0
         self.dataTypeDict = {}
 
     def AddDataType(self, dataType):
+        NoteSchemaChange()
         if dataType in ['int', 'float']:
             self.dataTypeDict[dataType] = numberHisto(dataType)
         elif dataType in ['str', 'unicode']:
@@ -127,53 +697,140 @@ class OneLineHisto:
 
         # print 'adding: %s %s'%(dataType, str(val))
 
-        if not dataType in self.dataTypeDict:
+        histo = self.dataTypeDict.get(dataType)
+        if histo is None:
             self.AddDataType(dataType)
-        self.dataTypeDict[dataType].Add(val)
+            histo = self.dataTypeDict[dataType]
+        histo.Add(val)
+
+    def merge(self, other):
+        self.sum += other.sum
+        self.n += other.n
+        for dataType in other.dataTypeDict.keys():
+            if not dataType in self.dataTypeDict:
+                self.AddDataType(dataType)
+            self.dataTypeDict[dataType].merge(other.dataTypeDict[dataType])
 
     def export(self):
         rStr = ''
-        for k in self.dataTypeDict.keys():
+        for k in sorted(self.dataTypeDict.keys()):
             r = ' %s' % self.dataTypeDict[k].export()
             rStr += r
         return rStr
 
 
-class numberHisto:
+class numberHisto(object):
 
     """numberHisto: Characterizes numeric types"""
 
+    __slots__ = (
+        'dataType',
+        'n',
+        'sum',
+        'max',
+        'min',
+        'distinct',
+        'quantiles',
+        'pending',
+        )
+
+    # The sketches are updated SketchBatch values at a time: Add only
+    # appends to pending, and Flush must be called before the sketches
+    # are read.
+
     def __init__(self, dataType):
         self.dataType = dataType
         self.n = 0
         self.sum = 0.0
         self.max = None
         self.min = None
+        self.distinct = None
+        self.quantiles = None
+        self.pending = None
+        if ValueSketches:
+            self.distinct = distinctSketch()
+            self.quantiles = quantileSketch()
+            self.pending = []
 
     def Add(self, val):
         self.n += 1
         val = float(val)
+        if self.pending is not None:
+            self.pending.append(val)
+            if len(self.pending) >= SketchBatch:
+                self.Flush()
         self.sum += val
-        if self.max == None or self.min == None:
+        if self.max is None:
             self.max = val
             self.min = val
-        if self.max < val:
+        elif self.max < val:
             self.max = val
-        if self.min > val:
+        elif self.min > val:
             self.min = val
 
+    def Flush(self):
+        """Flush: adds the values buffered by Add to the sketches"""
+
+        if self.pending:
+            self.distinct.AddLst(self.pending)
+            self.quantiles.AddLst(self.pending)
+            self.pending = []
+
+    def merge(self, other):
+        self.n += other.n
+        self.sum += other.sum
+        self.Flush()
+        other.Flush()
+        if self.distinct is None or other.distinct is None:
+            self.distinct = None
+            self.quantiles = None
+            self.pending = None
+        else:
+            self.distinct.merge(other.distinct)
+            self.quantiles.merge(other.quantiles)
+        if other.max == None or other.min == None:
+            return None
+        if self.max == None or self.min == None:
+            self.max = other.max
+            self.min = other.min
+        if self.max < other.max:
+            self.max = other.max
+        if self.min > other.min:
+            self.min = other.min
+
     def export(self):
         if self.dataType == 'int':
-            rstr = '[%s n=%i avg=%i min=%i max=%i]' % (self.dataType,
+            fmt = '%i'
+            rstr = '[%s n=%i avg=%i min=%i max=%i' % (self.dataType,
                     self.n, self.sum / self.n, self.min, self.max)
         else:
-            rstr = '[%s n=%i avg=%.2f min=%.2f max=%.2f]' \
+            fmt = '%.2f'
+            rstr = '[%s n=%i avg=%.2f min=%.2f max=%.2f' \
                 % (self.dataType, self.n, self.sum / self.n, self.min,
                    self.max)
-        return rstr
-
+        self.Flush()
+        if self.distinct is not None:
+            rstr += ' %s %s' % (self.quantiles.export(self.min,
+                                self.max, fmt),
+                                self.distinct.export(self.n))
+        return rstr + ']'
+
+
+class strHisto(object):
+
+    __slots__ = (
+        'dataType',
+        'n',
+        'sum',
+        'max',
+        'min',
+        'distinct',
+        'lengths',
+        'top',
+        'pending',
+        )
 
-class strHisto:
+    # Strings are buffered for the sketches as in numberHisto.
 
     def __init__(self, dataType):
         self.dataType = dataType
@@ -181,26 +838,79 @@ class strHisto:
         self.sum = 0.0
         self.max = None
         self.min = None
+        self.distinct = None
+        self.lengths = None
+        self.top = None
+        self.pending = None
+        if ValueSketches:
+            self.distinct = distinctSketch()
+            self.lengths = quantileSketch()
+            self.top = topKSummary()
+            self.pending = []
 
     def Add(self, instr):
         val = len(instr)
+        if self.pending is not None:
+            self.pending.append(instr)
+            if len(self.pending) >= SketchBatch:
+                self.Flush()
         self.n += 1
-        self.sum += float(val)
-        if self.max == None or self.min == None:
+        self.sum += val
+        if self.max is None:
             self.max = val
             self.min = val
-        if self.max < val:
+        elif self.max < val:
             self.max = val
-        if self.min > val:
+        elif self.min > val:
             self.min = val
 
+    def Flush(self):
+        """Flush: adds the strings buffered by Add to the sketches"""
+
+        if self.pending:
+            self.top.AddLst(self.pending)
+            self.lengths.AddLst(map(len, self.pending))
+            self.distinct.AddLst(self.pending)
+            self.pending = []
+
+    def merge(self, other):
+        self.n += other.n
+        self.sum += other.sum
+        self.Flush()
+        other.Flush()
+        if self.distinct is None or other.distinct is None:
+            self.distinct = None
+            self.lengths = None
+            self.top = None
+            self.pending = None
+        else:
+            self.distinct.merge(other.distinct)
+            self.lengths.merge(other.lengths)
+            self.top.merge(other.top)
+        if other.max == None or other.min == None:
+            return None
+        if self.max == None or self.min == None:
+            self.max = other.max
+            self.min = other.min
+        if self.max < other.max:
+            self.max = other.max
+        if self.min > other.min:
+            self.min = other.min
+
     def export(self):
-        rstr = '[%s n=%i avg_len=%.1f min=%i max=%i]' % (self.dataType,
+        rstr = '[%s n=%i avg_len=%.1f min=%i max=%i' % (self.dataType,
                 self.n, self.sum / self.n, self.min, self.max)
-        return rstr
+        self.Flush()
+        if self.distinct is not None:
+            rstr += ' len %s %s %s' % (self.lengths.export(self.min,
+                    self.max, '%i'), self.distinct.export(self.n),
+                    self.top.export(self.n))
+        return rstr + ']'
 
 
-class boolHisto:
+class boolHisto(object):
+
+    __slots__ = ('dataType', 'n', 'n_true', 'n_false')
 
     def __init__(self, dataType):
         self.dataType = dataType
@@ -210,20 +920,27 @@ class boolHisto:
 
     def Add(self, bval):
         self.n += 1
-        if bval == True:
+        if bval is True:
             self.n_true += 1
-        elif bval == False:
+        elif bval is False:
             self.n_false += 1
         else:
             raise 'Bad Value: %s' % str(bval)
 
+    def merge(self, other):
+        self.n += other.n
+        self.n_true += other.n_true
+        self.n_false += other.n_false
+
     def export(self):
         rstr = '[%s n=%i T/F:%i/%i]' % (self.dataType, self.n,
                 self.n_true, self.n_false)
         return rstr
 
 
-class noneHisto:
+class noneHisto(object):
+
+    __slots__ = ('dataType', 'n')
 
     def __init__(self, dataType):
         self.dataType = dataType
@@ -232,13 +949,54 @@ class noneHisto:
     def Add(self, bval):
         self.n += 1
 
+    def merge(self, other):
+        self.n += other.n
+
     def export(self):
         rstr = '[%s n=%i]' % (self.dataType, self.n)
         return rstr
 
 
+# Data type names, keyed on the exact type of a decoded JSON value
+
+TypeNames = {
+    dict: 'dict',
+    list: 'list',
+    int: 'int',
+    long: 'int',
+    float: 'float',
+    str: 'str',
+    unicode: 'unicode',
+    type(None): 'NoneType',
+    bool: 'bool',
+    }
+ScalarTypeNames = frozenset([
+    'int',
+    'float',
+    'str',
+    'unicode',
+    'NoneType',
+    'bool',
+    ])
+
+
 def DetermineType(obj):
-    """DetermineType: A hacky way to determine the incoming datatypes"""
+    """DetermineType: maps a decoded JSON value to its data type name with one dict lookup"""
+
+    type_name = TypeNames.get(type(obj))
+    if type_name == 'unicode':
+        try:
+            str(obj)
+        except UnicodeError:
+            return 'string:Non-unicode'
+        return type_name
+    if type_name != None:
+        return type_name
+    return DetermineTypeByName(obj)
+
+
+def DetermineTypeByName(obj):
+    """DetermineTypeByName: A hacky way to determine the incoming datatypes"""
 
     t = str(type(obj))
     if 'dict' in t:
@@ -329,6 +1087,31 @@ def ToPointLst(geoType, cLst):
     return coordLst
 
 
+def CharacterizePolygon(g_coords):
+    """CharacterizePolygon: CharacterizeGeometry of the rings of one polygon"""
+
+    if len(g_coords) > 1:
+        pLst = []
+        holeLst = []
+        geo_maxlen = 0
+        for i in range(len(g_coords)):
+            c = g_coords[i]
+            c = NoHeightInLatLong(c)
+            if len(c) > geo_maxlen:
+                geo_maxlen = len(c)
+            hole = not IsCCW(coords=c)
+            if hole:
+                holeLst.append([c])
+            else:
+                pLst.append([c])
+            print 'Polygon: part %i has %i points: Hole: %s' % (i,
+                    len(c), hole)
+
+        return ('Polygon_w_Holes', geo_maxlen, pLst, holeLst)
+    else:
+        return ('Polygon', len(g_coords[0]), [g_coords], [])
+
+
 def CharacterizeGeometry(gg):
     geo_maxlen = 0
     gtype = gg['type']
@@ -342,26 +1125,7 @@ def CharacterizeGeometry(gg):
         g_coords = NoHeightInLatLong(g_coords)
         return (gtype, geo_maxlen, [g_coords], [])
     elif gtype == u'Polygon':
-        if len(g_coords) > 1:
-            pLst = []
-            holeLst = []
-            geo_maxlen = 0
-            for i in range(len(g_coords)):
-                c = g_coords[i]
-                c = NoHeightInLatLong(c)
-                if len(c) > geo_maxlen:
-                    geo_maxlen = len(c)
-                hole = not IsCCW(coords=c)
-                if hole:
-                    holeLst.append([c])
-                else:
-                    pLst.append([c])
-                print 'Polygon: part %i has %i points: Hole: %s' % (i,
-                        len(c), hole)
-
-            return ('Polygon_w_Holes', geo_maxlen, pLst, holeLst)
-        else:
-            return ('Polygon', len(g_coords[0]), [g_coords], [])
+        return CharacterizePolygon(g_coords)
     elif gtype == 'MultiPoint':
         for pt in g_coords:
             pt = pt[:2]
@@ -380,8 +1144,7 @@ def CharacterizeGeometry(gg):
         pLst = []
         for i in range(len(g_coords)):
             polygon = g_coords[i]
-            ret = CharacterizeGeometry({'type': 'Polygon',
-                    'coordinates': polygon})
+            ret = CharacterizePolygon(polygon)
             if 'Holes' in ret[0]:
                 gtype = 'MultiPolygon_w_Holes'
                 coords = ret[3]
@@ -402,12 +1165,311 @@ def CharacterizeGeometry(gg):
         return ('GeoNotRecognized: >%s<' % gtype, 0, [], [])
 
 
-class geometryHisto:
+def GeometryArray(coords):
+    """GeometryArray: the longitude and latitude columns of a coordinate list as a float array, None when it does not convert cleanly"""
+
+    # Only numbers and booleans convert; float() would also accept
+    # numeric strings, which IsCCW cannot subtract.
+
+    try:
+        a = numpy.array(coords)
+    except (ValueError, TypeError):
+        return None
+    if a.ndim != 2 or a.shape[1] < 2 or not a.dtype.kind in 'biuf':
+        return None
+    a = a[:, :2].astype(float)
+    if not numpy.isfinite(a).all():
+        return None
+    return a
+
+
+def IsCCWArray(a):
+    """IsCCWArray: IsCCW on a coordinate array"""
+
+    # cumsum adds the edges one after the other like IsCCW does, so a
+    # ring that is nearly flat gets the same orientation.
+
+    if len(a) < 2:
+        return True
+    (x, y) = (a[:, 0], a[:, 1])
+    return not numpy.cumsum((x[1:] - x[:-1]) * (y[1:] + y[:-1]))[-1] \
+        > 0
+
+
+def CharacterizeGeometryArrays(gg):
+    """CharacterizeGeometryArrays: CharacterizeGeometry on numpy arrays, returns gtype, geo_maxlen, num_coords, bound box, first point"""
+
+    # Only used for geometries of at least ArrayGeometryMinVertices
+    # vertices. Returns None, before printing anything, whenever the
+    # coordinates are not a clean numeric array (ragged, missing, NaN or
+    # infinite values), so that CharacterizeGeometry and addCoords handle them
+    # exactly as before. The bound box covers the same points addCoords
+    # gets: every point except those of polygon holes.
+
+    gtype = gg['type']
+    g_coords = gg['coordinates']
+    try:
+        if gtype in ['LineString', 'MultiPoint']:
+            partLst = [[g_coords]]
+        elif gtype == 'MultiLineString':
+            partLst = [g_coords]
+        elif gtype == 'Polygon':
+            partLst = [g_coords]
+        elif gtype == 'MultiPolygon':
+            partLst = g_coords
+        else:
+            return None
+        numVertices = 0
+        for part in partLst:
+            if gtype in ['Polygon', 'MultiPolygon'] and len(part) == 0:
+                return None
+            for ring in part:
+                numVertices += len(ring)
+    except TypeError:
+        return None
+    if numVertices < ArrayGeometryMinVertices:
+        return None
+    arrayLst = []
+    for part in partLst:
+        ringArrayLst = []
+        for ring in part:
+            a = GeometryArray(ring)
+            if a is None:
+                return None
+            ringArrayLst.append(a)
+        arrayLst.append(ringArrayLst)
+
+    geo_maxlen = 0
+    boxLst = []
+    if gtype == 'LineString':
+        geo_maxlen = len(g_coords)
+        boxLst = arrayLst[0]
+    elif gtype == 'MultiPoint':
+        if len(g_coords) > 0:
+            geo_maxlen = 2
+        boxLst = arrayLst[0]
+    elif gtype == 'MultiLineString':
+        for ls in g_coords:
+            if len(ls) > geo_maxlen:
+                geo_maxlen = len(ls)
+        boxLst = arrayLst[0]
+    else:
+        for i in range(len(partLst)):
+            ringArrayLst = arrayLst[i]
+            if len(ringArrayLst) > 1:
+                lenc = 0
+                for j in range(len(ringArrayLst)):
+                    a = ringArrayLst[j]
+                    if len(a) > lenc:
+                        lenc = len(a)
+                    hole = not IsCCWArray(a)
+                    if not hole:
+                        boxLst.append(a)
+                    print 'Polygon: part %i has %i points: Hole: %s' \
+                        % (j, len(a), hole)
+                if gtype == 'Polygon':
+                    gtype = 'Polygon_w_Holes'
+                else:
+                    gtype = 'MultiPolygon_w_Holes'
+            else:
+                lenc = len(partLst[i][0])
+                boxLst.append(ringArrayLst[0])
+            if gg['type'] == 'MultiPolygon':
+                print 'MultiPolygon: part %i is %s has %i points' % (i,
+                        gtype, lenc)
+            if lenc > geo_maxlen:
+                geo_maxlen = lenc
+
+    num_coords = sum([len(a) for a in boxLst])
+    bbox = None
+    first = None
+    if num_coords > 0:
+        points = numpy.concatenate(boxLst)
+        (Lo_min, La_min) = points.min(axis=0)
+        (Lo_max, La_max) = points.max(axis=0)
+        bbox = (float(Lo_min), float(La_min), float(Lo_max),
+                float(La_max))
+        first = (float(points[0, 0]), float(points[0, 1]))
+    return (gtype, geo_maxlen, num_coords, bbox, first)
+
+
+def HilbertIndex(order, x, y):
+    """HilbertIndex: position of cell (x, y) along the Hilbert curve through a 2^order x 2^order grid"""
+
+    # The cell containing (x, y) at order - 1 has index d >> 2.
+
+    n = 1 << order
+    d = 0
+    s = n >> 1
+    while s > 0:
+        rx = int(x & s > 0)
+        ry = int(y & s > 0)
+        d += s * s * (3 * rx ^ ry)
+        if ry == 0:
+            if rx == 1:
+                x = n - 1 - x
+                y = n - 1 - y
+            (x, y) = (y, x)
+        s >>= 1
+    return d
+
+
+def HilbertCell(order, d):
+    """HilbertCell: the (x, y) cell at position d along the Hilbert curve, the inverse of HilbertIndex"""
+
+    n = 1 << order
+    (x, y) = (0, 0)
+    s = 1
+    while s < n:
+        rx = 1 & d // 2
+        ry = 1 & (d ^ rx)
+        if ry == 0:
+            if rx == 1:
+                x = s - 1 - x
+                y = s - 1 - y
+            (x, y) = (y, x)
+        x += s * rx
+        y += s * ry
+        d //= 4
+        s *= 2
+    return (x, y)
+
+
+class cellHisto(object):
+
+    """cellHisto: record counts per Hilbert curve cell of the longitude/latitude plane"""
+
+    # Each geometry is counted once, in the cell of its first point.
+    # Memory stays bounded: once more than MaxSpatialCells cells are
+    # occupied the grid is coarsened, four cells becoming their parent.
+
+    __slots__ = ('order', 'cells', 'n')
+
+    def __init__(self, order=None):
+        if order == None:
+            order = SpatialCellOrder
+        self.order = order
+        self.cells = {}
+        self.n = 0
+
+    def add(self, Lo, La):
+        side = 1 << self.order
+        x = int((Lo + 180.0) / 360.0 * side)
+        y = int((La + 90.0) / 180.0 * side)
+        x = min(max(x, 0), side - 1)
+        y = min(max(y, 0), side - 1)
+        d = HilbertIndex(self.order, x, y)
+        self.cells[d] = self.cells.get(d, 0) + 1
+        self.n += 1
+        if len(self.cells) > MaxSpatialCells:
+            self.coarsen()
+
+    def coarsen(self, order=None):
+        if order == None:
+            order = self.order - 1
+        while len(self.cells) > MaxSpatialCells or self.order > order:
+            cells = {}
+            for (d, count) in self.cells.iteritems():
+                cells[d >> 2] = cells.get(d >> 2, 0) + count
+            self.cells = cells
+            self.order -= 1
+
+    def merge(self, other):
+        if other.order < self.order:
+            self.coarsen(other.order)
+        shift = 2 * (other.order - self.order)
+        for (d, count) in other.cells.iteritems():
+            d >>= shift
+            self.cells[d] = self.cells.get(d, 0) + count
+        self.n += other.n
+        if len(self.cells) > MaxSpatialCells:
+            self.coarsen()
+
+    def CellBox(self, d):
+        """CellBox: [[lon min, lat min], [lon max, lat max]] of a cell"""
+
+        (x, y) = HilbertCell(self.order, d)
+        side = 1 << self.order
+        return '[[%0.2f, %0.2f],[%0.2f, %0.2f]]' % (-180.0 + 360.0 * x
+                / side, -90.0 + 180.0 * y / side, -180.0 + 360.0 * (x
+                + 1) / side, -90.0 + 180.0 * (y + 1) / side)
+
+    def export(self):
+        """export: DDL comment lines on the density distribution, the hottest cells and partitioning"""
+
+        side = 1 << self.order
+        if self.n == 0:
+            return ['-- Spatial density: no coordinates found']
+        countLst = sorted(self.cells.values(), reverse=True)
+
+        # The effective number of cells is 1 / sum(p^2): the number of
+        # equally full cells with the same concentration as the data.
+
+        effective = 1.0 / sum([(float(c) / self.n) ** 2 for c in
+                              countLst])
+        top = max(1, len(countLst) // 100)
+        topShare = float(sum(countLst[:top])) / self.n
+        Lst = \
+            ['-- Spatial density (Hilbert order %i, %ix%i cells over lon/lat): %i records in %i occupied cells, effective cells %.1f, hottest 1%% of cells hold %.1f%%'
+              % (
+            self.order,
+            side,
+            side,
+            self.n,
+            len(countLst),
+            effective,
+            100.0 * topShare,
+            )]
+        hotLst = sorted(self.cells.keys(), key=lambda d: (-self.cells[d],
+                        d))[:HotCellCount]
+        Lst.append('-- Hottest cells: %s' % ', '.join(['%.1f%% %s'
+                   % (100.0 * self.cells[d] / self.n,
+                   self.CellBox(d)) for d in hotLst]))
+        hottestShare = float(countLst[0]) / self.n
+        if self.n < 100:
+            advice = \
+                'too few records to judge spatial skew, PARTITION KEY ("geometry") kept'
+        elif len(countLst) == 1:
+            advice = \
+                'all records fall in one cell; PARTITION KEY ("geometry") cannot spread them, partition on an attribute that varies within the area, or profile with a larger --cell_order'
+        elif hottestShare > 0.05 or effective < 0.1 * len(countLst):
+            advice = \
+                'skewed: the hottest cell holds %.1f%% of records and they behave like %.0f of %i occupied cells. Partitions covering the hottest cells will run hot under PARTITION KEY ("geometry"); plan partition boundaries around them, or choose a key that spreads them' \
+                % (100.0 * hottestShare, effective, len(countLst))
+        else:
+            advice = \
+                'records are spread over %.0f effective cells; PARTITION KEY ("geometry") should balance well' \
+                % effective
+        Lst.append('-- Partitioning: %s' % advice)
+        return Lst
+
+
+class geometryHisto(object):
 
     """geomtryHisto: Inherits a few of the functions of value histograms"""
 
     # geometryHisto(attribute_name = "geometry", dataType = 'geometry')
 
+    __slots__ = (
+        'path',
+        'attribute_name',
+        'dataType',
+        'GeotypeDict',
+        'n',
+        'num_coords',
+        'parent_n',
+        'max',
+        'min',
+        'Holes',
+        'Nullable',
+        'Lo_max',
+        'Lo_min',
+        'La_max',
+        'La_min',
+        'histo',
+        'cells',
+        )
+
     def __init__(self, attribute_name='geometry', dataType='geometry'):
         self.path = 'geometry'
         self.attribute_name = attribute_name
@@ -424,12 +1486,18 @@ class geometryHisto:
         self.Lo_min = None
         self.La_max = None
         self.La_min = None
+        self.histo = None
+        self.cells = cellHisto()
 
     def ListAllNodes(self):
         return []
 
+    def CountNodes(self):
+        return 1
+
     def addCoords(self, geoType, geoObjLst):
         cLst = ToPointLst(geoType, geoObjLst)
+        first = True
         for c in cLst:
 
             # print 'c: ', c
@@ -440,7 +1508,17 @@ class geometryHisto:
             except:
                 print 'Bad Coordinates sent to addCoords: ', c, cLst
                 return None
+
+            # The json module accepts NaN and Infinity, which have no
+            # place in the bound box or the spatial cells.
+
+            if math.isnan(Lo) or math.isnan(La) or math.isinf(Lo) \
+                or math.isinf(La):
+                continue
             self.num_coords += 1
+            if first:
+                self.cells.add(Lo, La)
+                first = False
 
             # if Lo == 0.0 or La == 0.0: return None
 
@@ -459,6 +1537,29 @@ class geometryHisto:
             if self.La_min > La:
                 self.La_min = La
 
+    def addBoundBox(self, num_coords, bbox, first):
+        """addBoundBox: addCoords for coordinates already reduced to their count, bound box and first point"""
+
+        self.num_coords += num_coords
+        if bbox == None:
+            return None
+        self.cells.add(first[0], first[1])
+        (Lo_min, La_min, Lo_max, La_max) = bbox
+        if self.Lo_max == None or self.Lo_min == None \
+            or self.La_max == None or self.La_min == None:
+            self.Lo_max = Lo_max
+            self.Lo_min = Lo_min
+            self.La_max = La_max
+            self.La_min = La_min
+        if self.Lo_max < Lo_max:
+            self.Lo_max = Lo_max
+        if self.Lo_min > Lo_min:
+            self.Lo_min = Lo_min
+        if self.La_max < La_max:
+            self.La_max = La_max
+        if self.La_min > La_min:
+            self.La_min = La_min
+
     def BoundBox(self):
         if self.num_coords == 0:
             return '[No BoundingBox Calculated]'
@@ -476,9 +1577,18 @@ class geometryHisto:
             self.Nullable = True
 
     def DetermineGeoType(self, gObj):
-        ret = CharacterizeGeometry(gObj)  # returns >> gtype, geo_maxlen, pLst, holeLst
-        geoType = ret[0]
-        self.addCoords(geoType, ret[2])
+        t0 = time.time()
+        ret = None
+        if numpy != None:
+            ret = CharacterizeGeometryArrays(gObj)  # returns >> gtype, geo_maxlen, num_coords, bbox, first
+        if ret == None:
+            ret = CharacterizeGeometry(gObj)  # returns >> gtype, geo_maxlen, pLst, holeLst
+            geoType = ret[0]
+            self.addCoords(geoType, ret[2])
+        else:
+            geoType = ret[0]
+            self.addBoundBox(ret[2], ret[3], ret[4])
+        RunStats['geometry'] += time.time() - t0
 
         return (geoType, ret[1])  # ret[2]
 
@@ -487,6 +1597,7 @@ class geometryHisto:
         (geoType, max_numcoords) = self.DetermineGeoType(gObj)
         if not geoType in self.GeotypeDict:
             self.GeotypeDict[geoType] = 1
+            NoteSchemaChange()
         else:
             self.GeotypeDict[geoType] += 1
         val = max_numcoords
@@ -515,6 +1626,43 @@ class geometryHisto:
         if self.min > val:
             self.min = val
 
+    def merge(self, other):
+        self.n += other.n
+        self.num_coords += other.num_coords
+        self.Holes += other.Holes
+        for geoType in other.GeotypeDict.keys():
+            if not geoType in self.GeotypeDict:
+                self.GeotypeDict[geoType] = other.GeotypeDict[geoType]
+                NoteSchemaChange()
+            else:
+                self.GeotypeDict[geoType] += other.GeotypeDict[geoType]
+        if other.max != None and other.min != None:
+            if self.max == None or self.min == None:
+                self.max = other.max
+                self.min = other.min
+            if self.max < other.max:
+                self.max = other.max
+            if self.min > other.min:
+                self.min = other.min
+        self.cells.merge(other.cells)
+        if other.Lo_max == None or other.Lo_min == None \
+            or other.La_max == None or other.La_min == None:
+            return None
+        if self.Lo_max == None or self.Lo_min == None \
+            or self.La_max == None or self.La_min == None:
+            self.Lo_max = other.Lo_max
+            self.Lo_min = other.Lo_min
+            self.La_max = other.La_max
+            self.La_min = other.La_min
+        if self.Lo_max < other.Lo_max:
+            self.Lo_max = other.Lo_max
+        if self.Lo_min > other.Lo_min:
+            self.Lo_min = other.Lo_min
+        if self.La_max < other.La_max:
+            self.La_max = other.La_max
+        if self.La_min > other.La_min:
+            self.La_min = other.La_min
+
     def GenerateDDL(self, geo_type='geography', DumpLastComma=False):
         g = geo_type
         if DumpLastComma:
@@ -537,7 +1685,7 @@ class geometryHisto:
 
     def export(self):
         tstr = ''
-        for k in self.GeotypeDict.keys():
+        for k in sorted(self.GeotypeDict.keys()):
             tstr = tstr + '%s: %i ' % (k, self.GeotypeDict[k])
         rstr = \
             '[%s n=%i %s points: (min=%i max=%i)] numPolygonsWithHoles: %i // %s' \
@@ -553,10 +1701,27 @@ class geometryHisto:
         return rstr
 
 
-class DataNode:
+class DataNode(object):
 
     """DataNode: Hierarchical data structure element"""
 
+    __slots__ = (
+        'path',
+        'ListDictDesc',
+        'key',
+        'd',
+        'n',
+        'parent_n',
+        'typeLst',
+        'typeLst_ListSupport',
+        'DictLst_ListSupport',
+        'DictLst_Index',
+        'histo',
+        'root_name',
+        'Nullable',
+        'firstValue',
+        )
+
     def __init__(self, key, parent=None):
         if not parent:
             parent_path = 'root'
@@ -571,37 +1736,96 @@ class DataNode:
         self.typeLst = []  # These are types that populate this node
         self.typeLst_ListSupport = []  # Types found inside Lists
         self.DictLst_ListSupport = []  # Dicts found in Lists
+        self.DictLst_Index = {}  # DictLst_ListSupport by key-set signature
         self.histo = None
         self.root_name = ''
         self.Nullable = False
         self.firstValue = None
 
     def PropagateNumRecs(self, n=None):
+
+        # The tree is walked with an explicit stack instead of recursion,
+        # children pushed in reverse so they are visited in key order.
+
         if n == None:
             n = self.n
-        self.parent_n = n
-        if self.parent_n != self.n:
-            print '%s set by Propagation parent_n %i n %i' % (self,
-                    self.parent_n, self.n)
-            self.Nullable = True
-        if 'NoneType' in self.typeLst:
-            print '%s set by Propagation NoneType in typeLst: %s' \
-                % (self, str(self.typeLst))
-            self.Nullable = True
-        for k in self.d.keys():
-            self.d[k].PropagateNumRecs(n)
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            if not isinstance(node, DataNode):
+                node.PropagateNumRecs(n)
+                continue
+            node.parent_n = n
+            if node.parent_n != node.n:
+                print '%s set by Propagation parent_n %i n %i' % (node,
+                        node.parent_n, node.n)
+                node.Nullable = True
+            if 'NoneType' in node.typeLst:
+                print '%s set by Propagation NoneType in typeLst: %s' \
+                    % (node, str(node.typeLst))
+                node.Nullable = True
+            keyLst = node.d.keys()
+            keyLst.reverse()
+            stack.extend([node.d[k] for k in keyLst])
+
+    def CountNodes(self):
+        """CountNodes: number of nodes in this subtree, list element nodes included"""
+
+        count = 0
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            count += 1
+            if isinstance(node, DataNode):
+                stack.extend(node.d.values())
+                stack.extend(node.DictLst_ListSupport)
+        return count
 
     def ListAllNodes(self):
-        oLst = [self]
-        for k in self.d.keys():
 
-            # if k == 'geometry': continue
+        # Pre-order, children in sorted key order, each child's path
+        # printed as it is reached. geometryHisto children are printed
+        # but not listed.
 
-            print self.d[k].path
-            oLst.extend(self.d[k].ListAllNodes())
+        oLst = []
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            if node is not self:
+                print node.path
+            if not isinstance(node, DataNode):
+                continue
+            oLst.append(node)
+            keyLst = sorted(node.d.keys())
+            keyLst.reverse()
+            stack.extend([node.d[k] for k in keyLst])
         return oLst
 
     def add(self, key, dictorobj):
+        """add: adds a value and everything nested in it below this node"""
+
+        # Nesting is followed with an explicit stack rather than by
+        # recursion, so the depth of a document is limited only by
+        # memory. Scalars are added as their dict is walked; only dicts
+        # are pushed, as (node, dict) items whose keys are added below
+        # node. The keys of one dict fill disjoint subtrees and may be
+        # popped in any order. Elements of a list can share an element
+        # node, so they are pushed in reverse and popped in document
+        # order, keeping the first-seen values of a depth-first walk.
+
+        stack = []
+        self.addValue(key, dictorobj, stack)
+        while stack:
+            (node, indict) = stack.pop()
+            for (inkey, val) in indict.iteritems():
+                node.addValue(inkey, val, stack)
+
+    def addValue(
+        self,
+        key,
+        dictorobj,
+        stack,
+        ):
 
         # Three disinct things are done here:
         # 1. add appropriate data histograms to keep track of and characterize built_in types...
@@ -609,18 +1833,24 @@ class DataNode:
         # 2. Hold child nodes for embedded types
         # 3. Deal with unusual geometry where a builtin looks on the surface like a dictionary
 
-        key = unicode(key)
+        # The value's type is determined once here and handed down, and
+        # the child node is found with a single dict lookup.
+
+        if type(key) is not unicode:
+            key = unicode(key)
+        type_name = self.DetermineType(dictorobj)
+        node = self.d.get(key)
 
         # Seen this key before?
 
-        if key in self.d.keys():
+        if node is not None:
 
             # pre-existing types
 
-            if key == 'geometry' or self.DetermineType(dictorobj) == 'geometry':
+            if key == 'geometry' or type_name == 'geometry':
 
                 try:
-                    self.d[key].add(dictorobj)
+                    node.add(dictorobj)
                     return None
                 except:
 
@@ -635,7 +1865,7 @@ class DataNode:
                     sys.exit(0)
             else:
                 try:
-                    self.d[key].incr()  # just keeps track of the fact that some value existed for this record
+                    node.incr()  # just keeps track of the fact that some value existed for this record
                 except:
                     print '''Tried to load this:
  %s 
@@ -648,75 +1878,100 @@ class DataNode:
 
             # initialize new types
 
-            if key == 'geometry' or self.DetermineType(dictorobj) == 'geometry':
+            if key == 'geometry' or type_name == 'geometry':
 
                 # geometryHisto(attribute_name = "geometry", dataType = 'geometry')
 
-                self.d[key] = geometryHisto(attribute_name=key)
-                self.d[key].histo = self.d[key]  # weird for geometry types: dict that MUST not spawn a node because it is a builtin This breaks our typing model
-                self.d[key].add(dictorobj)
+                node = geometryHisto(attribute_name=key)
+                self.d[key] = node
+                NoteSchemaChange()
+                node.histo = node  # weird for geometry types: dict that MUST not spawn a node because it is a builtin This breaks our typing model
+                node.add(dictorobj)
                 return None
             else:
-                self.d[key] = DataNode(key, self)  # Here you spawn a node
+                node = DataNode(key, self)  # Here you spawn a node
+                self.d[key] = node
+                NoteSchemaChange()
 
-        # Add Type to TypeLst
+        # Add Type to TypeLst, queue what is nested in the value
 
-        dataType = self.addKeyType(key, dictorobj)
+        self.addKeyType(node, dictorobj, type_name, stack)
 
         # DataHistogram
 
-        if dataType in [
-            'int',
-            'float',
-            'str',
-            'unicode',
-            'NoneType',
-            'bool',
-            ]:
-            if self.d[key].histo == None:
-                self.d[key].histo = OneLineHisto()
-            self.d[key].histo.Add(dataType, dictorobj)
-        if dataType == 'NoneType':
-            self.Nullabe = True
-        if self.d[key].firstValue == None:
-            self.d[key].firstValue = dictorobj
-
-    def addKeyType(self, key, dictorobj):
-        type_name = self.DetermineType(dictorobj)
-        if type_name == 'geometry':
-            self.d[key].addType(dictorobj)
-        elif type_name == 'dict':
-            self.d[key].addType(dictorobj)
-            for inkey in dictorobj.keys():
-                self.d[key].add(inkey, dictorobj[inkey])
+        # firstValue is only kept for scalars: holding on to the first
+        # dict or list would pin a whole document and make the pickled
+        # profile as deep as the document.
+
+        if type_name in ScalarTypeNames:
+            if node.histo is None:
+                node.histo = OneLineHisto()
+            node.histo.Add(type_name, dictorobj)
+            if node.firstValue is None:
+                node.firstValue = dictorobj
+
+    def addKeyType(
+        self,
+        node,
+        dictorobj,
+        type_name,
+        stack,
+        ):
+        node.addType(type_name)
+        if type_name == 'dict':
+            stack.append((node, dictorobj))
         elif type_name == 'list':
 
             # ListSupport
 
-            self.d[key].addType(dictorobj)
-            self.AddToLst_ListSupport(dictorobj)
-        else:
-            self.d[key].addType(dictorobj)
+            node.AddToLst_ListSupport(dictorobj, stack)
         return type_name
 
-    def addType(self, dictorobj):
-        type_name = self.DetermineType(dictorobj)
+    def addType(self, type_name):
         if not type_name in self.typeLst:
             self.typeLst.append(type_name)
+            NoteSchemaChange()
+
+    def ListElemSignature(self, indict):
+        """ListElemSignature: the key set that selects the element node for a dict found in a list"""
+
+        if UnifyListElements:
+            return None
+        return frozenset(indict)
 
-    def AddToLst_ListSupport(self, inLst):
+    def AddToLst_ListSupport(self, inLst, stack):
+
+        # Element nodes are found by a hash lookup on the element's key
+        # set. In an element node, n counts elements and each child's n
+        # counts the elements holding that key. The elements are queued
+        # on stack for DataNode.add, in document order.
+
+        itemLst = []
         for elem in inLst:
             t = self.DetermineType(elem)
             if t == 'dict':
-                found = False
-                for node in self.DictLst_ListSupport:
-                    if node.HasKeys(elem):
-                        found = True
-                        break
-                if not found:
+                signature = self.ListElemSignature(elem)
+                node = self.DictLst_Index.get(signature)
+                if node is None:
                     node = DataNode('Dict_LstElem', self)
                     self.DictLst_ListSupport.append(node)
-                node.AddDict(elem)
+                    self.DictLst_Index[signature] = node
+                    NoteSchemaChange()
+                else:
+                    node.incr()
+                itemLst.append((node, elem))
+        itemLst.reverse()
+        stack.extend(itemLst)
+
+    def ListElemDesc(self):
+        """ListElemDesc: element count and per-key presence of a unified list element schema"""
+
+        if not UnifyListElements or not self.DictLst_ListSupport:
+            return self.ListDictDesc
+        node = self.DictLst_ListSupport[0]
+        keyLst = ['%s:%i' % (k, node.d[k].n) for k in
+                  sorted(node.d.keys())]
+        return ' elements: n=%i keys: %s' % (node.n, ' '.join(keyLst))
 
     def HasKeys(self, indict):
         kscore = 0
@@ -731,36 +1986,78 @@ class DataNode:
         return False
 
     def AddDict(self, indict):
-        for k in indict.keys():
-            self.add(k, indict[k])
+        for (k, v) in indict.iteritems():
+            self.add(k, v)
 
     def incr(self):
         self.n += 1
 
+    def merge(self, other):
+        """merge: folds a DataNode built from another part of the input into this one"""
+
+        self.n += other.n
+        self.MergeChildren(other)
+
+    def MergeChildren(self, other):
+
+        # Pairs of nodes still to be merged are kept on a stack, so
+        # merging does not recurse once per level.
+
+        stack = [(self, other)]
+        while stack:
+            (node, onode) = stack.pop()
+            node.MergeNode(onode, stack)
+
+    def MergeNode(self, other, stack):
+        for t in other.typeLst:
+            if not t in self.typeLst:
+                self.typeLst.append(t)
+                NoteSchemaChange()
+        for t in other.typeLst_ListSupport:
+            if not t in self.typeLst_ListSupport:
+                self.typeLst_ListSupport.append(t)
+        if other.histo != None:
+            if self.histo == None:
+                self.histo = other.histo
+                NoteSchemaChange()
+            else:
+                self.histo.merge(other.histo)
+        if self.firstValue == None:
+            self.firstValue = other.firstValue
+        for onode in other.DictLst_ListSupport:
+            signature = self.ListElemSignature(onode.d)
+            node = self.DictLst_Index.get(signature)
+            if node is not None:
+                node.n += onode.n
+                stack.append((node, onode))
+            else:
+                self.DictLst_ListSupport.append(onode)
+                self.DictLst_Index[signature] = onode
+                NoteSchemaChange()
+        for key in other.d.keys():
+            if not key in self.d:
+                self.d[key] = other.d[key]
+                NoteSchemaChange()
+            elif isinstance(self.d[key], geometryHisto) \
+                != isinstance(other.d[key], geometryHisto):
+                print '''Tried to merge this:
+ %s
+
+ Into this: %s''' \
+                    % (str(other.d[key]), str(self.d[key]))
+                print 'This attribute probably has a mixture of geometry and multiple other types. Unsupported.'
+                sys.exit(0)
+            elif isinstance(self.d[key], geometryHisto):
+                self.d[key].merge(other.d[key])
+            else:
+                self.d[key].n += other.d[key].n
+                stack.append((self.d[key], other.d[key]))
+
     def DetermineType(self, obj):
-        t = str(type(obj))
-        if 'dict' in t:
-            if self.IsGeometryType(obj):
-                return 'geometry'
-            return 'dict'
-        if 'list' in t:
-            return 'list'
-        if 'int' in t:
-            return 'int'
-        if 'float' in t:
-            return 'float'
-        if 'str' in t:
-            return 'str'
-        if 'NoneType' in t:
-            return 'NoneType'
-        if 'bool' in t:
-            return 'bool'
-        try:
-            s = str(obj).encode('utf-8')
-            return 'unicode'
-        except:
-            return 'string:Non-unicode'  # unicode(str(obj).content.strip(codecs.BOM_UTF8), 'utf-8')
-        return 'unknownType'
+        type_name = DetermineType(obj)
+        if type_name == 'dict' and self.IsGeometryType(obj):
+            return 'geometry'
+        return type_name
 
     def IsGeometryType(self, dict_obj):
         if len(dict_obj) == 2:
@@ -820,11 +2117,12 @@ class DataNode:
 
         outerNode.PropagateNumRecs()
 
-        # Feature type
+        # Feature type. The statements are collected in oLst and joined
+        # once: appending to one string is quadratic on deep trees.
 
-        oStr = \
-            """CREATE TYPE %s.feature IS WHEN "Feature" THEN UNIT;\n""" \
-            % schemaName
+        oLst = \
+            ["""CREATE TYPE %s.feature IS WHEN "Feature" THEN UNIT;\n""" \
+             % schemaName]
 
         # start making attribute types from the parent node onwards
 
@@ -833,31 +2131,39 @@ class DataNode:
             if node.Generate_DDL_TableTypeOrScalar() == 'type':
                 typStr = node.GenerateDDL_CreateType(schemaName,
                         tableName)
-                oStr = oStr + '\n' + typStr
+                oLst.append(typStr)
                 if CleanUpInput:
                     submitStr = self.MakeSubmittableTable(typStr)
-                    oStr = oStr + '''
+                    oLst[-1] = oLst[-1] + '''
 
 ''' + submitStr
             elif node.Generate_DDL_TableTypeOrScalar() == 'geometry':
                 geoStr = self.ReturnGeometryType().GenerateDDL()
-                oStr = oStr + '\n' + geoStr
+                oLst.append(geoStr)
                 if CleanUpInput:
                     submitStr = self.MakeSubmittableTable(geoStr)
-                    oStr = oStr + '''
+                    oLst[-1] = oLst[-1] + '''
 
 ''' + submitStr
             else:
                 pass  # oStr = oStr + '\n--[%s] Unsuported type: %s\n'%(node.path, str(node.typeLst))
 
+        # Spatial density and partitioning advice
+
+        geoNode = outerNode.ReturnGeometryType()
+        if geoNode == None:
+            oLst.append('-- Partitioning: no geometry attribute found, PARTITION KEY ("geometry") needs one')
+        else:
+            oLst.append('\n'.join(geoNode.cells.export()))
+
         # Make outerNode Table
 
         ddl_str = outerNode.GenerateDDL_CreateTable(schemaName, tableName)
-        oStr = oStr + '\n' + ddl_str
+        oLst.append(ddl_str)
         if CleanUpInput:
             submitStr = self.MakeSubmittableTable(ddl_str)
-            oStr = oStr + '\n' + submitStr
-        return oStr
+            oLst.append(submitStr)
+        return '\n'.join(oLst)
 
     def ReturnGeometryType(self):
         if 'geometry' in self.d:
@@ -919,18 +2225,42 @@ class DataNode:
                 if not used_varchar:
                     oStr = 'VARCHAR'
                     used_varchar = True
+                    histo = self.histo \
+                        and self.histo.dataTypeDict.get(varType)
+                    if histo:
+                        histo.Flush()
+                    if histo and histo.top is not None \
+                        and histo.top.Exact() \
+                        and len(histo.top.counts) \
+                        <= CategoricalMaxValues and histo.n \
+                        >= 10 * len(histo.top.counts):
+                        commentStr += \
+                            '--categorical: %i distinct' \
+                            % len(histo.top.counts)
                 else:
                     continue
             if varType == 'float':
-                if self.histo.dataTypeDict[varType].max > 1e38:  # IEEE-754 floating point values:
+                histo = self.histo.dataTypeDict[varType]
+                histo.Flush()
+                if histo.max > 1e38:  # IEEE-754 floating point values:
                     oStr = 'BINARY DOUBLE'
+                    if histo.quantiles is not None \
+                        and histo.quantiles.Quantile(0.999) <= 1e38:
+                        commentStr += \
+                            '--DOUBLE only for values above p99.9'
                 else:
                     oStr = 'BINARY FLOAT'
             if varType == 'int':
-                if self.histo.dataTypeDict[varType].min >= 0:
+                histo = self.histo.dataTypeDict[varType]
+                histo.Flush()
+                if histo.min >= 0:
                     oStr = 'UNSIGNED BIGINT'
                 else:
                     oStr = 'BIGINT'
+                    if histo.quantiles is not None \
+                        and histo.quantiles.Quantile(0.001) >= 0:
+                        commentStr += \
+                            '--signed only for values below p0.1'
             if self.histo and 'bool' in self.histo.dataTypeDict:
                 oStr = ' BOOLEAN'
 
@@ -1032,7 +2362,7 @@ class DataNode:
             self.key,
             self.typeLst,
             self.n,
-            self.ListDictDesc,
+            self.ListElemDesc(),
             histoOutput,
             self.path,
             )
@@ -1044,6 +2374,1757 @@ class DataNode:
 
 MaxNumRecsToCount = 100000000
 DDL_CleanUpInput = False
+UnifyListElements = False
+ValueSketches = True
+ArrayGeometryMinVertices = 256
+SpatialCellOrder = 10
+MaxSpatialCells = 65536
+HotCellCount = 5
+CacheHashBytes = 65536
+DeepDecodeStackBytes = 32 * 1024 * 1024
+DeepDecodeBytesPerLevel = 1024
+ReadBlockSize = 4 * 1024 * 1024
+DecompressQueueBlocks = 8
+FeatureCollectionScanner = None
+CleanBatchRecords = 1000
+CleanQueueBatches = 8
+
+# A JSON string, with the colon following it when it is a key, and a
+# list starting with three numbers, a position with a height.
+
+StringPattern = re.compile(r'"[^"\\]*(?:\\.[^"\\]*)*"(\s*:)?')
+HeightPattern = re.compile(r'\[\s*[-+.\deE]+\s*,\s*[-+.\deE]+\s*,\s*[-+.\d]'
+                           )
+CompressionMagic = [('gz', '\x1f\x8b'), ('bz2', 'BZh'), ('xz',
+                    '\xfd7zXZ\x00'), ('zst', '(\xb5/\xfd')]
+CompressionExtensions = {
+    '.gz': 'gz',
+    '.gzip': 'gz',
+    '.bz2': 'bz2',
+    '.xz': 'xz',
+    '.zst': 'zst',
+    }
+DecompressCommands = {
+    'gz': [['pigz', '-dc'], ['gzip', '-dc']],
+    'bz2': [['lbzip2', '-dc'], ['pbzip2', '-dc'], ['bzip2', '-dc']],
+    'xz': [['xz', '-dc']],
+    'zst': [['zstd', '-dc']],
+    }
+Verbose = False
+ProgressEvery = 10
+RunStart = time.time()
+
+# Counters and stage timings of this process, in seconds. Worker
+# processes hand theirs back to be merged. 'add' includes 'geometry';
+# 'write' runs in the --clean_output writer thread, overlapping the rest.
+
+RunStats = {
+    'records': 0,
+    'bytes': 0,
+    'read_bytes': 0,
+    'read': 0.0,
+    'decode': 0.0,
+    'add': 0.0,
+    'geometry': 0.0,
+    'ddl': 0.0,
+    'write': 0.0,
+    }
+StageNames = ['read', 'decode', 'add', 'geometry', 'ddl', 'write']
+ProfileVersion = 12
+ProfileClassNames = [
+    'DataNode',
+    'OneLineHisto',
+    'numberHisto',
+    'strHisto',
+    'boolHisto',
+    'noneHisto',
+    'geometryHisto',
+    'cellHisto',
+    'distinctSketch',
+    'quantileSketch',
+    'topKSummary',
+    ]
+
+
+def PackTree(RootNode):
+    """PackTree: the DataNodes of a tree as a flat list whose child links are list indexes, for pickling"""
+
+    # cPickle recurses once per nested object, so a deep tree is passed
+    # around as shallow copies of its nodes with every DataNode
+    # reference replaced by the index of that node in the list.
+
+    nodeLst = []
+    indexDict = {}
+    stack = [RootNode]
+    while stack:
+        node = stack.pop()
+        indexDict[id(node)] = len(nodeLst)
+        nodeLst.append(node)
+        for child in node.d.values():
+            if isinstance(child, DataNode):
+                stack.append(child)
+        stack.extend(node.DictLst_ListSupport)
+    packedLst = []
+    for node in nodeLst:
+        packed = DataNode.__new__(DataNode)
+        for name in DataNode.__slots__:
+            setattr(packed, name, getattr(node, name))
+        packed.d = {}
+        for (k, child) in node.d.iteritems():
+            if isinstance(child, DataNode):
+                packed.d[k] = indexDict[id(child)]
+            else:
+                packed.d[k] = child
+        packed.DictLst_ListSupport = [indexDict[id(child)] for child in
+                node.DictLst_ListSupport]
+        packed.DictLst_Index = {}
+        for (signature, child) in node.DictLst_Index.iteritems():
+            packed.DictLst_Index[signature] = indexDict[id(child)]
+        packedLst.append(packed)
+    return packedLst
+
+
+def UnpackTree(packedLst):
+    """UnpackTree: relinks a list made by PackTree, returns its root DataNode"""
+
+    for node in packedLst:
+        for (k, child) in node.d.items():
+            if type(child) is int:
+                node.d[k] = packedLst[child]
+        node.DictLst_ListSupport = [packedLst[i] for i in
+                                    node.DictLst_ListSupport]
+        for (signature, i) in node.DictLst_Index.items():
+            node.DictLst_Index[signature] = packedLst[i]
+    return packedLst[0]
+
+
+def SaveProfile(
+    profilePath,
+    RootNode,
+    n,
+    FileLst,
+    FileOffsets,
+    table_name,
+    InodeOffsets=None,
+    ):
+    """SaveProfile: writes the complete profile state to disk, replacing the previous checkpoint atomically"""
+
+    # FileOffsets maps each input path to [byteOffset, lineNum, done]:
+    # everything before byteOffset has been profiled. InodeOffsets holds
+    # the same per (device, inode) for --watch.
+
+    state = {
+        'version': ProfileVersion,
+        'RootNode': PackTree(RootNode),
+        'n': n,
+        'FileLst': FileLst,
+        'FileOffsets': FileOffsets,
+        'table_name': table_name,
+        'UnifyListElements': UnifyListElements,
+        'InodeOffsets': InodeOffsets or {},
+        }
+    WritePickle(profilePath, state)
+
+
+def WritePickle(path, obj):
+    """WritePickle: writes obj as a gzipped pickle, replacing the file atomically"""
+
+    tmpPath = '%s.%i.tmp' % (path, os.getpid())
+    fp = gzip.open(tmpPath, 'wb', 6)
+    try:
+        cPickle.dump(obj, fp, cPickle.HIGHEST_PROTOCOL)
+    finally:
+        fp.close()
+    os.rename(tmpPath, path)
+
+
+def ReadPickle(path):
+    """ReadPickle: reads a file written by WritePickle, allowing only profile classes"""
+
+    # Unpickling straight from the gzip file costs a read() call per
+    # object, so the file is decompressed into memory first.
+
+    fp = gzip.open(path, 'rb')
+    try:
+        unpickler = cPickle.Unpickler(cStringIO.StringIO(fp.read()))
+        unpickler.find_global = FindProfileClass
+        return unpickler.load()
+    finally:
+        fp.close()
+
+
+def FindProfileClass(module, name):
+    """FindProfileClass: resolves pickled profile classes to this script, whatever module name it ran under"""
+
+    if name in ProfileClassNames:
+        return globals()[name]
+    if module == 'copy_reg' and name in ('__newobj__', '_reconstructor'):
+        return getattr(copy_reg, name)
+    if module == '__builtin__' and name in ('object', 'set',
+            'frozenset', 'bytearray'):
+        return getattr(__builtin__, name)
+    raise cPickle.UnpicklingError('%s.%s is not a profile class'
+                                  % (module, name))
+
+
+def LoadProfile(profilePath):
+    """LoadProfile: reads a profile state written by SaveProfile"""
+
+    state = ReadPickle(profilePath)
+    if state.get('version') != ProfileVersion:
+        sys.stderr.write('%s: unsupported profile version %s\n'
+                         % (profilePath, state.get('version')))
+        sys.exit(1)
+    state['RootNode'] = UnpackTree(state['RootNode'])
+    return state
+
+
+class ProfileCache:
+
+    """ProfileCache: per-file profiles on disk, keyed by a file fingerprint, least recently used removed first"""
+
+    # The key hashes the file's path, size and mtime, its first and last
+    # CacheHashBytes bytes, and the settings that shape a profile. A
+    # profile's mtime is its last use.
+
+    def __init__(self, cacheDir, maxBytes, settings):
+        self.cacheDir = cacheDir
+        self.maxBytes = maxBytes
+        self.settings = settings
+        self.hits = 0
+        self.misses = 0
+        if not os.path.isdir(cacheDir):
+            os.makedirs(cacheDir)
+
+    def Key(self, inpath):
+        st = os.stat(inpath)
+        h = hashlib.md5(repr((ProfileVersion, self.settings,
+                        os.path.abspath(inpath), st.st_size,
+                        st.st_mtime)))
+        fp = open(inpath, 'rb')
+        try:
+            h.update(fp.read(CacheHashBytes))
+            if st.st_size > CacheHashBytes:
+                fp.seek(max(CacheHashBytes, st.st_size
+                        - CacheHashBytes))
+                h.update(fp.read(CacheHashBytes))
+        finally:
+            fp.close()
+        return h.hexdigest()
+
+    def Path(self, key):
+        return os.path.join(self.cacheDir, key + '.profile')
+
+    def Load(self, key):
+        """Load: (DataNode tree, record count) cached under key, None when there is none"""
+
+        path = self.Path(key)
+        try:
+            state = ReadPickle(path)
+            if state.get('version') != ProfileVersion:
+                raise ValueError('profile version %s'
+                                 % state.get('version'))
+            os.utime(path, None)
+        except (IOError, OSError):
+            self.misses += 1
+            return None
+        except Exception, e:
+            print 'Removing unreadable cached profile %s: %s' % (path,
+                    e)
+            os.remove(path)
+            self.misses += 1
+            return None
+        self.hits += 1
+        return (UnpackTree(state['RootNode']), state['n'])
+
+    def Store(self, key, RootNode, n):
+        WritePickle(self.Path(key), {'version': ProfileVersion,
+                    'RootNode': PackTree(RootNode), 'n': n})
+        self.Evict()
+
+    def Evict(self):
+        fileLst = []
+        total = 0
+        for name in os.listdir(self.cacheDir):
+            if not name.endswith('.profile'):
+                continue
+            path = os.path.join(self.cacheDir, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            fileLst.append((st.st_mtime, st.st_size, path))
+            total += st.st_size
+        fileLst.sort()
+        for (mtime, size, path) in fileLst:
+            if total <= self.maxBytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
+
+def SplitFile(inpath, numChunks, start=0):
+    """SplitFile: cuts a file into at most numChunks byte ranges that start and end on newline boundaries"""
+
+    # Compressed files and FeatureCollections cannot be entered in the
+    # middle and are never cut.
+
+    size = os.path.getsize(inpath)
+    if numChunks < 2 or size <= start or IsSequential(inpath):
+        return [(start, None)]
+    fp = open(inpath, 'rb')
+    mm = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+    rangeLst = []
+    first = start
+    try:
+        for i in range(1, numChunks):
+            pos = mm.find('\n', max(start, first + (size - first) * i
+                          // numChunks))
+            if pos < 0 or pos + 1 >= size:
+                break
+            rangeLst.append((start, pos + 1))
+            start = pos + 1
+    finally:
+        mm.close()
+        fp.close()
+    rangeLst.append((start, size))
+    return rangeLst
+
+
+def CountLines(inpath, start, end):
+    """CountLines: the number of newlines in the byte range [start, end) of a file"""
+
+    count = 0
+    fp = open(inpath, 'rb')
+    try:
+        fp.seek(start)
+        remaining = end - start
+        while remaining > 0:
+            block = fp.read(min(ReadBlockSize, remaining))
+            if not block:
+                break
+            remaining -= len(block)
+            count += block.count('\n')
+    finally:
+        fp.close()
+    return count
+
+
+def CompressionType(inpath):
+    """CompressionType: gz, bz2, xz or zst for a compressed file, None for plain text"""
+
+    # The magic bytes decide; the extension is only a fallback for files
+    # too short to carry them.
+
+    fp = open(inpath, 'rb')
+    magic = fp.read(6)
+    fp.close()
+    for (compression, prefix) in CompressionMagic:
+        if magic.startswith(prefix):
+            return compression
+    if len(magic) < 6:
+        return CompressionExtensions.get(os.path.splitext(inpath)[1].lower())
+    return None
+
+
+def IsSequential(inpath):
+    """IsSequential: True for files that can only be read from the start, compressed files and FeatureCollections"""
+
+    return FeatureCollectionScanner != None or CompressionType(inpath) \
+        != None
+
+
+def PipeBlocks(command, inpath):
+    """PipeBlocks: yields the output of a decompressor process run on inpath, in large blocks"""
+
+    # The decompressor runs in its own process, so it overlaps with
+    # decoding and profiling in this one.
+
+    proc = subprocess.Popen(command + [inpath], stdout=subprocess.PIPE,
+                            bufsize=ReadBlockSize)
+    try:
+        while True:
+            block = proc.stdout.read(ReadBlockSize)
+            if not block:
+                break
+            yield block
+        if proc.wait() != 0:
+            raise IOError('%s failed on %s' % (command[0], inpath))
+    finally:
+        if proc.poll() == None:
+            proc.kill()
+            proc.wait()
+        proc.stdout.close()
+
+
+def StreamBlocks(compression, inpath):
+    """StreamBlocks: yields the decompressed contents of inpath, decompressed in a background thread"""
+
+    # Concatenated streams, like multi-member gzip files, are decompressed
+    # one after the other. zlib, bz2 and lzma release the GIL while they
+    # work, so the thread overlaps with decoding and profiling.
+
+    blockQueue = Queue.Queue(DecompressQueueBlocks)
+    stop = threading.Event()
+
+    def Put(item):
+        while not stop.is_set():
+            try:
+                blockQueue.put(item, timeout=0.1)
+                return True
+            except Queue.Full:
+                pass
+        return False
+
+    def Decompress():
+        try:
+            fp = open(inpath, 'rb')
+            try:
+                decompressor = StreamDecompressors[compression]()
+                while True:
+                    data = fp.read(ReadBlockSize)
+                    if not data:
+                        break
+                    while data:
+                        try:
+                            block = decompressor.decompress(data)
+                        except EOFError:
+
+                            # bz2 and lzma refuse data after the end of a
+                            # member that ended exactly at a read boundary
+
+                            decompressor = \
+                                StreamDecompressors[compression]()
+                            block = decompressor.decompress(data)
+                        data = decompressor.unused_data
+                        if data:
+                            decompressor = \
+                                StreamDecompressors[compression]()
+                        if block and not Put(('block', block)):
+                            return
+            finally:
+                fp.close()
+            Put(('end', None))
+        except Exception, e:
+            Put(('error', e))
+
+    thread = threading.Thread(target=Decompress)
+    thread.daemon = True
+    thread.start()
+    try:
+        while True:
+            (kind, item) = blockQueue.get()
+            if kind == 'end':
+                break
+            if kind == 'error':
+                raise item
+            yield item
+    finally:
+        stop.set()
+        thread.join()
+
+
+def ReadBlocks(inpath, start=0):
+    """ReadBlocks: yields the contents of a file from byte start on, in large blocks, decompressed when needed"""
+
+    # Offsets into a compressed file count decompressed bytes, so the
+    # stream is read and dropped up to start.
+
+    compression = CompressionType(inpath)
+    if compression == None:
+        fp = open(inpath, 'rb')
+        try:
+            fp.seek(start)
+            while True:
+                block = fp.read(ReadBlockSize)
+                if not block:
+                    break
+                yield block
+        finally:
+            fp.close()
+        return
+    for command in DecompressCommands[compression]:
+        if find_executable(command[0]):
+            blocks = PipeBlocks(command, inpath)
+            break
+    else:
+        if not compression in StreamDecompressors:
+            raise IOError('no %s decompressor is installed for %s'
+                          % (compression, inpath))
+        blocks = StreamBlocks(compression, inpath)
+    try:
+        for block in blocks:
+            if start >= len(block):
+                start -= len(block)
+                continue
+            if start:
+                block = block[start:]
+                start = 0
+            yield block
+    finally:
+        blocks.close()
+
+
+def ReadLineBlocks(inpath, start=0, end=None):
+    """ReadLineBlocks: yields the lines of the byte range [start, end) of a file, read in large blocks"""
+
+    # The range must start on a line boundary. Lines keep their newline;
+    # only the last line of the file may lack one.
+
+    blocks = ReadBlocks(inpath, start)
+    try:
+        remaining = None
+        if end != None:
+            remaining = end - start
+        tail = ''
+        while True:
+            t0 = time.time()
+            block = next(blocks, None)
+            RunStats['read'] += time.time() - t0
+            if block == None:
+                break
+            if remaining != None:
+                block = block[:remaining]
+                remaining -= len(block)
+            RunStats['read_bytes'] += len(block)
+            lineLst = (tail + block).split('\n')
+            tail = lineLst.pop()
+            for line in lineLst:
+                yield line + '\n'
+            if remaining == 0:
+                break
+        if tail:
+            yield tail
+    finally:
+        blocks.close()
+
+
+def ReadFeatureLines(inpath, start=0, end=None):
+    """ReadFeatureLines: yields the features of a FeatureCollection file as lines, from line byte start on"""
+
+    # The features are cut out by the scanner of geojson-to-sc.py and
+    # yielded as if the file held one feature per line. Offsets count
+    # the bytes of these lines, like offsets into a compressed file count
+    # decompressed bytes, so the lines before start are dropped.
+
+    scanner = FeatureCollectionScanner()
+    blocks = ReadBlocks(inpath)
+    offset = 0
+    try:
+        while end == None or offset < end:
+            t0 = time.time()
+            block = next(blocks, None)
+            if block == None:
+                try:
+                    scanner.close()
+                except ValueError, e:
+                    raise IOError('%s: %s' % (inpath, e))
+                break
+            lineLst = scanner.feed(block)
+            RunStats['read'] += time.time() - t0
+            RunStats['read_bytes'] += len(block)
+            for line in lineLst:
+                offset += len(line)
+                if offset > start and (end == None or offset - len(line)
+                        < end):
+                    yield line
+    finally:
+        blocks.close()
+
+
+def OpenLines(inpath, start=0, end=None):
+    """OpenLines: iterates the lines of a whole file, or of the byte range [start, end)"""
+
+    if FeatureCollectionScanner != None:
+        return ReadFeatureLines(inpath, start, end)
+    return ReadLineBlocks(inpath, start, end)
+
+
+def IsStream(inpath):
+    """IsStream: True for - (stdin) and named pipes, which can only be read once, front to back"""
+
+    if inpath == '-':
+        return True
+    try:
+        return stat.S_ISFIFO(os.stat(inpath).st_mode)
+    except OSError:
+        return False
+
+
+def StreamLines(inpath, idleSeconds=None):
+    """StreamLines: yields the lines of stdin or a named pipe as they arrive, None after idleSeconds without input"""
+
+    # os.read returns whatever the writer has sent so far instead of
+    # waiting for a full block, so records are profiled as they arrive.
+    # A line arriving in many pieces is joined once, at its newline. A
+    # FeatureCollection stream yields each feature once its closing
+    # brace has arrived.
+
+    scanner = None
+    if FeatureCollectionScanner != None:
+        scanner = FeatureCollectionScanner()
+    fp = None
+    if inpath == '-':
+        fd = sys.stdin.fileno()
+    else:
+        fp = open(inpath, 'rb')
+        fd = fp.fileno()
+    try:
+        pieceLst = []
+        while True:
+            if idleSeconds:
+                (ready, w, x) = select.select([fd], [], [], idleSeconds)
+                if not ready:
+                    yield None
+                    continue
+            t0 = time.time()
+            block = os.read(fd, ReadBlockSize)
+            RunStats['read'] += time.time() - t0
+            if not block:
+                break
+            RunStats['read_bytes'] += len(block)
+            if scanner:
+                t0 = time.time()
+                lineLst = scanner.feed(block)
+                RunStats['read'] += time.time() - t0
+                for line in lineLst:
+                    yield line
+                continue
+            if not '\n' in block:
+                pieceLst.append(block)
+                continue
+            pieceLst.append(block)
+            lineLst = ''.join(pieceLst).split('\n')
+            pieceLst = [lineLst.pop()]
+            for line in lineLst:
+                yield line + '\n'
+        if scanner:
+            try:
+                scanner.close()
+            except ValueError, e:
+                raise IOError('%s: %s' % (inpath, e))
+        tail = ''.join(pieceLst)
+        if tail:
+            yield tail
+    finally:
+        if fp:
+            fp.close()
+
+
+def WriteDDL(ddlPath, ddlStr):
+    """WriteDDL: writes a DDL file, replacing the previous version atomically"""
+
+    tmpPath = ddlPath + '.tmp'
+    fp = open(tmpPath, 'w')
+    try:
+        fp.write(ddlStr)
+    finally:
+        fp.close()
+    os.rename(tmpPath, ddlPath)
+
+
+def DecodeDeepLine(line):
+    """DecodeDeepLine: decodes a line nested too deeply for the interpreter's recursion limit"""
+
+    # The JSON decoders recurse once per nesting level. The line is
+    # decoded again with the standard decoder in a thread whose stack
+    # and recursion limit are sized for the deepest nesting the line
+    # could hold.
+
+    depth = line.count('{') + line.count('[')
+    result = []
+
+    def Decode():
+        try:
+            result.append(json.loads(line))
+        except Exception, e:
+            result.append(e)
+
+    limit = sys.getrecursionlimit()
+    stackSize = threading.stack_size(max(DeepDecodeStackBytes, depth
+            * DeepDecodeBytesPerLevel))
+    sys.setrecursionlimit(limit + 2 * depth)
+    try:
+        thread = threading.Thread(target=Decode)
+        thread.start()
+        thread.join()
+    finally:
+        sys.setrecursionlimit(limit)
+        threading.stack_size(stackSize)
+    if isinstance(result[0], Exception):
+        raise result[0]
+    return result[0]
+
+
+def DecodeLine(line):
+    """DecodeLine: repairs known formatting glitches in a line and decodes it as JSON"""
+
+    # print '>>%s<<'%line[-2:]
+
+    t0 = time.time()
+    line = line.replace(',  ]', ']')
+    if line[-2:] == ',\n':
+        line = line[:-2]
+    try:
+        jsonObj = JsonLoads(line)
+    except RuntimeError:
+        jsonObj = DecodeDeepLine(line)
+    RunStats['decode'] += time.time() - t0
+    RunStats['bytes'] += len(line)
+    RunStats['records'] += 1
+    return jsonObj
+
+
+def StripHeight(coords):
+    """StripHeight: drops the third coordinate of every position in a geometry's coordinates, in place, True when there was one"""
+
+    changed = False
+    stack = [coords]
+    while stack:
+        c = stack.pop()
+        if not isinstance(c, list) or not c:
+            continue
+        if not isinstance(c[0], list):
+
+            # A single position, the coordinates of a Point
+
+            if len(c) > 2:
+                del c[2:]
+                changed = True
+        elif c[0] and not isinstance(c[0][0], list):
+
+            # A list of positions
+
+            height = False
+            for p in c:
+                if not isinstance(p, list):
+                    break
+                if len(p) > 2:
+                    height = True
+            else:
+                if height:
+                    c[:] = NoHeightInLatLong(c)
+                    changed = True
+        else:
+            stack.extend(c)
+    return changed
+
+
+def CleanRecord(jsonObj, lowerCase=False):
+    """CleanRecord: drops height coordinates from the geometries of a decoded record and lower-cases its keys, in place, True when it changed"""
+
+    changed = False
+    stack = [jsonObj]
+    while stack:
+        obj = stack.pop()
+        if isinstance(obj, dict):
+            if lowerCase and any(k != k.lower() for k in obj):
+                itemLst = obj.items()
+                obj.clear()
+                for (k, v) in itemLst:
+                    obj[k.lower()] = v
+                changed = True
+            if 'type' in obj and 'coordinates' in obj:
+                if StripHeight(obj['coordinates']):
+                    changed = True
+                stack.extend([v for (k, v) in obj.iteritems() if k
+                             != 'coordinates'])
+            else:
+                stack.extend(obj.itervalues())
+        elif isinstance(obj, list):
+            stack.extend(obj)
+    return changed
+
+
+def HasUpperKey(line):
+    """HasUpperKey: True when a key of the JSON text line may change when lower-cased"""
+
+    for m in StringPattern.finditer(line):
+        if m.group(1) != None:
+            key = m.group()
+            if key != key.lower() or '\\' in key:
+                return True
+    return False
+
+
+def CleanLine(line, jsonObj):
+    """CleanLine: the ingestible output line of one profiled record"""
+
+    # Walking the record is slower than scanning its line, so the record
+    # is only cleaned when the line has a key to lower-case or a list
+    # starting with three numbers. A record that needed no change is
+    # written as it was read. DecodeLine repairs ',  ]' and a trailing
+    # comma, so such lines are always re-encoded.
+
+    changed = False
+    if HeightPattern.search(line) or AttributesToLower_Case \
+        and HasUpperKey(line):
+        changed = CleanRecord(jsonObj, AttributesToLower_Case)
+    if changed or ',  ]' in line or line.rstrip()[-1:] == ',':
+        return json.dumps(jsonObj, separators=(',', ':')) + '\n'
+    return line.strip() + '\n'
+
+
+class CleanWriter:
+
+    """CleanWriter: writes profiled records to the --clean_output file from a background thread"""
+
+    # Records are handed over in batches once they have been profiled.
+    # The thread cleans, encodes and writes a batch while the next one
+    # is decoded and profiled. Profiling keeps no reference into a
+    # record, so the thread may change it in place. Part files written
+    # by worker processes are appended whole, in the order they are
+    # handed over, and removed.
+
+    def __init__(self, outpath):
+        self.outpath = outpath
+        self.fp = open(outpath, 'wb', ReadBlockSize)
+        self.batchQueue = Queue.Queue(CleanQueueBatches)
+        self.batch = []
+        self.n = 0
+        self.error = None
+        self.thread = threading.Thread(target=self.Write)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def Write(self):
+        while True:
+            item = self.batchQueue.get()
+            if item == None:
+                break
+            if self.error:
+                continue  # keep draining so that Add never blocks
+            t0 = time.time()
+            try:
+                if isinstance(item, list):
+                    self.fp.write(''.join([CleanLine(line, jsonObj)
+                                  for (line, jsonObj) in item]))
+                else:
+                    partfp = open(item, 'rb')
+                    try:
+                        while True:
+                            block = partfp.read(ReadBlockSize)
+                            if not block:
+                                break
+                            self.fp.write(block)
+                    finally:
+                        partfp.close()
+                    os.remove(item)
+                if self.batchQueue.empty():
+                    self.fp.flush()
+            except Exception, e:
+                self.error = e
+            RunStats['write'] += time.time() - t0
+
+    def Add(self, line, jsonObj):
+        self.batch.append((line, jsonObj))
+        if len(self.batch) >= CleanBatchRecords:
+            self.Flush()
+
+    def AddFile(self, partpath, numRecords):
+        self.Flush()
+        self.batchQueue.put(partpath)
+        self.n += numRecords
+
+    def Flush(self):
+        """Flush: hands the records added so far to the thread"""
+
+        if self.error:
+            raise self.error
+        if self.batch:
+            self.batchQueue.put(self.batch)
+            self.n += len(self.batch)
+            self.batch = []
+
+    def Close(self):
+        """Close: waits until everything has been written, returns the number of records written"""
+
+        try:
+            self.Flush()
+        finally:
+            self.batchQueue.put(None)
+            self.thread.join()
+            self.fp.close()
+        if self.error:
+            raise self.error
+        return self.n
+
+
+def AddRecord(RootNode, table_name, jsonObj):
+    """AddRecord: adds one decoded record to RootNode, timing it"""
+
+    t0 = time.time()
+    RootNode.add(table_name, jsonObj)
+    RunStats['add'] += time.time() - t0
+
+
+def TakeRunStats():
+    """TakeRunStats: returns the counters of this process and resets them"""
+
+    stats = dict(RunStats)
+    for k in RunStats.keys():
+        RunStats[k] -= stats[k]
+    return stats
+
+
+def MergeRunStats(stats):
+    for k in stats.keys():
+        RunStats[k] += stats[k]
+
+
+def PeakRSS():
+    """PeakRSS: peak resident set size in KB of this process and of its largest finished child, None when unknown"""
+
+    if resource == None:
+        return (None, None)
+    scale = 1
+    if sys.platform == 'darwin':
+        scale = 1024  # bytes, not KB
+    return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // scale,
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+            // scale)
+
+
+def ReportProgress(n, force=False):
+    """ReportProgress: writes a throughput line to stderr at most every ProgressEvery seconds"""
+
+    now = time.time()
+    if not force and now - ProgressState['last'] < ProgressEvery:
+        return
+    ProgressState['last'] = now
+    elapsed = max(now - RunStart, 1e-9)
+    sys.stderr.write('Progress: %i records, %.1f MB read in %.0fs (%.0f records/s, %.1f MB/s)\n'
+                      % (n, RunStats['read_bytes'] / 1048576.0,
+                     elapsed, n / elapsed, RunStats['read_bytes']
+                     / 1048576.0 / elapsed))
+
+
+ProgressState = {'last': time.time()}
+
+
+class ConvergenceMonitor:
+
+    """ConvergenceMonitor: decides when the scan has stopped discovering new schema elements"""
+
+    def __init__(self, windowRecs=None, windowBytes=None):
+        self.windowRecs = windowRecs
+        self.windowBytes = windowBytes
+        self.nbytes = 0  # bytes of input finished before the current file
+        self.lastChanges = None
+        self.lastRec = 0
+        self.lastByte = 0
+        self.stopReason = None
+
+    def Converged(self, n, nbytes):
+        if SchemaChanges != self.lastChanges:
+            self.lastChanges = SchemaChanges
+            self.lastRec = n
+            self.lastByte = nbytes
+            return False
+        if self.windowRecs and n - self.lastRec >= self.windowRecs:
+            self.stopReason = \
+                'schema converged: no new key path or type in the last %i records' \
+                % (n - self.lastRec)
+        elif self.windowBytes and nbytes - self.lastByte \
+            >= self.windowBytes:
+            self.stopReason = \
+                'schema converged: no new key path or type in the last %i bytes' \
+                % (nbytes - self.lastByte)
+        return self.stopReason != None
+
+
+def RandomOpenUnit(rng):
+    """RandomOpenUnit: a uniform random number in the open interval (0, 1)"""
+
+    u = rng.random()
+    while u == 0.0:
+        u = rng.random()
+    return u
+
+
+def SampleRandom(seed, inpath, start=0):
+    """SampleRandom: a random generator for one file or byte range, derived from the run seed"""
+
+    return random.Random(int(hashlib.md5('%s:%s:%s' % (seed, inpath,
+                         start)).hexdigest(), 16))
+
+
+def ReservoirSample(items, k, rng):
+    """ReservoirSample: draws a uniform random sample of k items from an iterable of unknown length"""
+
+    # Li's Algorithm L: once the reservoir is full, the number of items to
+    # skip before the next replacement is drawn directly, so a skipped
+    # item costs one iteration step and no random numbers.
+
+    reservoir = []
+    if k <= 0:
+        return reservoir
+    it = iter(items)
+    for item in it:
+        reservoir.append(item)
+        if len(reservoir) == k:
+            break
+    if len(reservoir) < k:
+        return reservoir
+    w = math.exp(math.log(RandomOpenUnit(rng)) / k)
+    while w > 0.0:
+        skip = math.log(RandomOpenUnit(rng)) / math.log1p(-w)
+        skip = int(min(skip, sys.maxsize - 1))
+        nextLst = list(itertools.islice(it, skip, skip + 1))
+        if not nextLst:
+            break
+        reservoir[rng.randrange(k)] = nextLst[0]
+        w *= math.exp(math.log(RandomOpenUnit(rng)) / k)
+    return reservoir
+
+
+def AllocateSample(sampleSize, weightLst):
+    """AllocateSample: splits sampleSize over strata in proportion to their weights"""
+
+    # Largest remainder method, so the allocations add up to sampleSize.
+
+    total = float(sum(weightLst))
+    if total <= 0:
+        return [0] * len(weightLst)
+    quotaLst = [sampleSize * w / total for w in weightLst]
+    allocLst = [int(q) for q in quotaLst]
+    order = sorted(range(len(quotaLst)), key=lambda i: allocLst[i] \
+                   - quotaLst[i])
+    for i in order[:sampleSize - sum(allocLst)]:
+        allocLst[i] += 1
+    return allocLst
+
+
+def ProfileSample(
+    RootNode,
+    inpath,
+    table_name,
+    sampleSize,
+    seed,
+    f=1,
+    numf=1,
+    n=0,
+    start=0,
+    end=None,
+    FileOffsets=None,
+    monitor=None,
+    progress=None,
+    ):
+    """ProfileSample: feeds a uniform random sample of sampleSize lines of one file or byte range into RootNode"""
+
+    # Every line is read but only the sampled ones are decoded. They are
+    # profiled in file order, so firstValue does not depend on the draw.
+
+    print inpath
+    ifn = os.path.basename(inpath)
+    rng = SampleRandom(seed, inpath, start)
+    infp = OpenLines(inpath, start, end)
+    sampleLst = ReservoirSample(enumerate(infp, 1), sampleSize, rng)
+    infp.close()
+    sampleLst.sort()
+    print 'Files %s %i of %i sampled %i records' % (ifn, f, numf,
+            len(sampleLst))
+    for (l, line) in sampleLst:
+        if n > MaxNumRecsToCount:
+            break
+        try:
+            jsonObj = DecodeLine(line)
+        except:
+            print '''Failed Reading this line %i of %i in %s:
+>>%s<<
+''' \
+                % (l, n, ifn, line)
+            continue
+        n += 1
+        AddRecord(RootNode, table_name, jsonObj)
+        if monitor and monitor.Converged(n, monitor.nbytes):
+            break
+    if progress:
+        progress(n)
+    if FileOffsets != None:
+        FileOffsets[inpath] = [os.path.getsize(inpath), 0, True]
+    return n
+
+
+def InputLines(FileLst):
+    """InputLines: yields (file index, line number, line) for every line of every input, streams included"""
+
+    for f in range(len(FileLst)):
+        inpath = FileLst[f]
+        print inpath
+        if IsStream(inpath):
+            infp = StreamLines(inpath)
+        else:
+            infp = OpenLines(inpath, 0, None)
+        for (l, line) in enumerate(infp, 1):
+            yield (f, l, line)
+        infp.close()
+
+
+def ProfileStreamSample(
+    RootNode,
+    FileLst,
+    table_name,
+    sampleSize,
+    seed,
+    n=0,
+    monitor=None,
+    progress=None,
+    ):
+    """ProfileStreamSample: feeds a uniform random sample of sampleSize lines of inputs that include streams into RootNode"""
+
+    # The length of a stream is only known once it ends, so sampleSize
+    # cannot be shared out in proportion to the input sizes as for
+    # regular files. One reservoir is drawn over the lines of all the
+    # inputs instead, read in turn, and the sample is profiled in input
+    # order. Streams have no offsets to resume from, so FileOffsets is
+    # not kept.
+
+    rng = SampleRandom(seed, '\t'.join(FileLst))
+    sampleLst = ReservoirSample(InputLines(FileLst), sampleSize, rng)
+    sampleLst.sort()
+    print 'Files %i sampled %i records' % (len(FileLst), len(sampleLst))
+    for (f, l, line) in sampleLst:
+        if n > MaxNumRecsToCount:
+            break
+        try:
+            jsonObj = DecodeLine(line)
+        except:
+            print '''Failed Reading this line %i of %i in %s:
+>>%s<<
+''' \
+                % (l, n, os.path.basename(FileLst[f]), line)
+            continue
+        n += 1
+        AddRecord(RootNode, table_name, jsonObj)
+        if monitor and monitor.Converged(n, monitor.nbytes):
+            break
+    if progress:
+        progress(n)
+    return n
+
+
+def ProfileSeekSample(
+    RootNode,
+    inpath,
+    table_name,
+    sampleSize,
+    seed,
+    f=1,
+    numf=1,
+    n=0,
+    FileOffsets=None,
+    monitor=None,
+    progress=None,
+    offsetLst=None,
+    ):
+    """ProfileSeekSample: feeds the records found at sampleSize random byte offsets of one file into RootNode"""
+
+    # Each offset is moved forward to the start of the next line, wrapping
+    # around to the first line at the end of the file. A line is therefore
+    # picked with probability proportional to the length of the line
+    # before it. Offsets are visited in file order and a line hit twice
+    # is profiled once. (file, offset, line start) triples are appended
+    # to offsetLst when given.
+
+    # Compressed files and FeatureCollections cannot be seeked into,
+    # they get a reservoir sample.
+
+    if IsSequential(inpath):
+        print 'Files %s %i of %i cannot be seeked into, sampling every line' \
+            % (os.path.basename(inpath), f, numf)
+        return ProfileSample(
+            RootNode,
+            inpath,
+            table_name,
+            sampleSize,
+            seed,
+            f=f,
+            numf=numf,
+            n=n,
+            FileOffsets=FileOffsets,
+            monitor=monitor,
+            progress=progress,
+            )
+    print inpath
+    ifn = os.path.basename(inpath)
+    size = os.path.getsize(inpath)
+    rng = SampleRandom(seed, inpath)
+    seekLst = []
+    if size > 0:
+        seekLst = sorted([rng.randrange(size) for i in
+                         range(sampleSize)])
+    seen = set()
+    fp = open(inpath, 'rb')
+    try:
+        for offset in seekLst:
+            lineStart = 0
+            if offset > 0:
+                fp.seek(offset - 1)
+                fp.readline()
+                lineStart = fp.tell()
+                if lineStart >= size:
+                    lineStart = 0
+            if offsetLst != None:
+                offsetLst.append((inpath, offset, lineStart))
+            if lineStart in seen:
+                continue
+            seen.add(lineStart)
+            if n > MaxNumRecsToCount:
+                break
+            fp.seek(lineStart)
+            line = fp.readline()
+            try:
+                jsonObj = DecodeLine(line)
+            except:
+                print '''Failed Reading the line at byte %i of %i in %s:
+>>%s<<
+''' \
+                    % (lineStart, n, ifn, line)
+                continue
+            n += 1
+            AddRecord(RootNode, table_name, jsonObj)
+            if monitor and monitor.Converged(n, monitor.nbytes):
+                break
+    finally:
+        fp.close()
+    print 'Files %s %i of %i sampled %i records at %i offsets' % (ifn,
+            f, numf, len(seen), len(seekLst))
+    if progress:
+        progress(n)
+    if FileOffsets != None:
+        FileOffsets[inpath] = [size, 0, True]
+    return n
+
+
+def ProfileFile(
+    RootNode,
+    inpath,
+    table_name,
+    sampler=1,
+    maxrecsperfile=None,
+    f=1,
+    numf=1,
+    n=0,
+    start=0,
+    end=None,
+    l=0,
+    FileOffsets=None,
+    checkpointEvery=None,
+    checkpoint=None,
+    monitor=None,
+    progress=None,
+    writer=None,
+    ):
+    """ProfileFile: feeds every sampled record of one input file into RootNode, returns the running record count"""
+
+    # Only the lines starting inside [start, end) are read. l is the
+    # number of lines already read before start, used by the sampler.
+    # When FileOffsets is given it is kept up to date for checkpoints.
+    # Every record added is also handed to writer when given.
+
+    n_f = l
+    print inpath
+    ifn = os.path.basename(inpath)
+    infp = OpenLines(inpath, start, end)
+    offset = start
+    for line in infp:
+        offset += len(line)
+        n_f += 1
+        l += 1
+        if l % 1000 == 0:
+            if Verbose:
+                print 'Files %s %i of %i total records processed %i ' \
+                    % (ifn, f, numf, n)
+            if progress:
+                progress(n)
+
+            # print line
+        # print "%imod%i %i"%(l, sampler, l%sampler)
+
+        if l % sampler > 0:
+            continue
+        if n > MaxNumRecsToCount:
+            break
+        if line == '\lf':
+            continue
+        try:
+            jsonObj = DecodeLine(line)
+        except:
+            print '''Failed Reading this line %i of %i in %s:
+>>%s<<
+''' \
+                % (l, n, ifn, line)
+            continue
+        if maxrecsperfile and n_f > maxrecsperfile:
+            break
+        n += 1
+        AddRecord(RootNode, table_name, jsonObj)
+        if writer:
+            writer.Add(line, jsonObj)
+        if checkpoint and n % checkpointEvery == 0:
+            FileOffsets[inpath] = [offset, l, False]
+            checkpoint(n)
+        if monitor and monitor.Converged(n, monitor.nbytes + offset
+                - start):
+            break
+    infp.close()
+    if monitor:
+        monitor.nbytes += offset - start
+    if FileOffsets != None:
+        FileOffsets[inpath] = [offset, l, True]
+    return n
+
+
+def ProfileStream(
+    RootNode,
+    inpath,
+    table_name,
+    sampler=1,
+    maxrecsperfile=None,
+    f=1,
+    numf=1,
+    n=0,
+    checkpointEvery=None,
+    checkpoint=None,
+    updateEvery=None,
+    updateSeconds=None,
+    update=None,
+    monitor=None,
+    progress=None,
+    writer=None,
+    ):
+    """ProfileStream: feeds the records of stdin or a named pipe into RootNode as they arrive, returns the running record count"""
+
+    # The stream is read until the writer closes it. update(n) is called
+    # once updateEvery records have been added since the last update, or
+    # once the oldest record not yet in an update is updateSeconds old,
+    # also while the stream is idle. Streams have no offsets to resume
+    # from, so FileOffsets is not kept.
+
+    print inpath
+    ifn = os.path.basename(inpath)
+    l = 0
+    nbytes = 0
+    updatedN = n
+    pendingSince = None
+    for line in StreamLines(inpath, updateSeconds):
+        if line != None:
+            nbytes += len(line)
+            l += 1
+            if l % 1000 == 0:
+                if Verbose:
+                    print 'Files %s %i of %i total records processed %i ' \
+                        % (ifn, f, numf, n)
+                if progress:
+                    progress(n)
+        elif progress:
+            progress(n)
+        if line != None and l % sampler == 0 and line.strip():
+            if n > MaxNumRecsToCount:
+                break
+            try:
+                jsonObj = DecodeLine(line)
+            except:
+                print '''Failed Reading this line %i of %i in %s:
+>>%s<<
+''' \
+                    % (l, n, ifn, line)
+                continue
+            if maxrecsperfile and l > maxrecsperfile:
+                break
+            n += 1
+            AddRecord(RootNode, table_name, jsonObj)
+            if writer:
+                writer.Add(line, jsonObj)
+            if pendingSince == None:
+                pendingSince = time.time()
+            if checkpoint and n % checkpointEvery == 0:
+                checkpoint(n)
+            if monitor and monitor.Converged(n, monitor.nbytes
+                    + nbytes):
+                break
+        if update and pendingSince != None:
+            if updateEvery and n - updatedN >= updateEvery \
+                or updateSeconds and time.time() - pendingSince \
+                >= updateSeconds:
+                update(n)
+                updatedN = n
+                pendingSince = None
+    if monitor:
+        monitor.nbytes += nbytes
+    return n
+
+
+def ProfileFileCached(
+    cache,
+    RootNode,
+    inpath,
+    table_name,
+    sampler=1,
+    maxrecsperfile=None,
+    f=1,
+    numf=1,
+    n=0,
+    FileOffsets=None,
+    progress=None,
+    ):
+    """ProfileFileCached: merges the cached profile of an unchanged file, or profiles the file into a tree of its own and caches it"""
+
+    # The file's tree is cached before it is merged: merging hands its
+    # nodes over to RootNode.
+
+    key = cache.Key(inpath)
+    cached = cache.Load(key)
+    if cached != None:
+        (fileNode, n_f) = cached
+        print '%s: profile from cache' % inpath
+        if FileOffsets != None:
+            FileOffsets[inpath] = [os.path.getsize(inpath), 0, True]
+    else:
+        fileNode = DataNode('root')
+        n_f = ProfileFile(
+            fileNode,
+            inpath,
+            table_name,
+            sampler=sampler,
+            maxrecsperfile=maxrecsperfile,
+            f=f,
+            numf=numf,
+            n=n,
+            FileOffsets=FileOffsets,
+            progress=progress,
+            ) - n
+        if n + n_f <= MaxNumRecsToCount:
+            cache.Store(key, fileNode, n_f)
+    RootNode.MergeChildren(fileNode)
+    return n + n_f
+
+
+def WatchPaths(patternLst):
+    """WatchPaths: the files matching the input paths or wildcard patterns, in pattern order"""
+
+    pathLst = []
+    seen = set()
+    for pattern in patternLst:
+        for inpath in sorted(glob.glob(pattern)):
+            if not inpath in seen and os.path.isfile(inpath):
+                seen.add(inpath)
+                pathLst.append(inpath)
+    return pathLst
+
+
+def CompleteLinesEnd(inpath, start, size):
+    """CompleteLinesEnd: the offset just past the last newline in [start, size) of a file, start when there is none"""
+
+    fp = open(inpath, 'rb')
+    try:
+        pos = size
+        while pos > start:
+            blockStart = max(start, pos - 65536)
+            fp.seek(blockStart)
+            i = fp.read(pos - blockStart).rfind('\n')
+            if i >= 0:
+                return blockStart + i + 1
+            pos = blockStart
+        return start
+    finally:
+        fp.close()
+
+
+def WatchFiles(
+    RootNode,
+    patternLst,
+    table_name,
+    watchSeconds,
+    InodeOffsets,
+    sampler=1,
+    maxrecsperfile=None,
+    n=0,
+    update=None,
+    progress=None,
+    writer=None,
+    ):
+    """WatchFiles: profiles lines appended to the input files and files newly matching the input patterns, polling until interrupted"""
+
+    # InodeOffsets maps (device, inode) to [byteOffset, lineNum], so a
+    # poll only stats the files and reads what was appended since the
+    # last one. A file renamed by log rotation keeps its inode and is
+    # continued where it was left; a file that shrank was truncated and
+    # is read again from the start. Only complete lines are read, a
+    # line still being written waits for the next poll. Compressed
+    # files are profiled whole on the first poll; those appearing
+    # later, usually compressed copies of rotated files, are skipped.
+    # update(n) is called after each poll that added records. SIGINT
+    # and SIGTERM end the watch between files or polls.
+
+    stopLst = []
+
+    def Stop(signum, frame):
+        stopLst.append(signum)
+
+    handlerLst = [(signum, signal.signal(signum, Stop)) for signum in
+                  (signal.SIGINT, signal.SIGTERM)]
+    first = not InodeOffsets
+    try:
+        while not stopLst and n <= MaxNumRecsToCount:
+            pollN = n
+            pathLst = WatchPaths(patternLst)
+            for f in range(len(pathLst)):
+                if stopLst or n > MaxNumRecsToCount:
+                    break
+                inpath = pathLst[f]
+                try:
+                    st = os.stat(inpath)
+                except OSError:
+                    continue  # rotated away since the glob
+                key = (st.st_dev, st.st_ino)
+                (start, l) = InodeOffsets.get(key, [0, 0])
+                if CompressionType(inpath) != None:
+                    if key in InodeOffsets or not first:
+                        InodeOffsets[key] = [st.st_size, l]
+                        continue
+                    end = None
+                else:
+                    if st.st_size < start:
+                        print '%s was truncated, reading it again' \
+                            % inpath
+                        (start, l) = (0, 0)
+                    end = CompleteLinesEnd(inpath, start, st.st_size)
+                    if end == start:
+                        continue
+                offsetDict = {}
+                n = ProfileFile(
+                    RootNode,
+                    inpath,
+                    table_name,
+                    sampler=sampler,
+                    maxrecsperfile=maxrecsperfile,
+                    f=f + 1,
+                    numf=len(pathLst),
+                    n=n,
+                    start=start,
+                    end=end,
+                    l=l,
+                    FileOffsets=offsetDict,
+                    progress=progress,
+                    writer=writer,
+                    )
+                InodeOffsets[key] = [end or st.st_size,
+                                     offsetDict[inpath][1]]
+            if update and n > pollN:
+                update(n)
+            first = False
+            deadline = time.time() + watchSeconds
+            while not stopLst and time.time() < deadline:
+                time.sleep(min(0.25, max(deadline - time.time(), 0)))
+    finally:
+        for (signum, handler) in handlerLst:
+            signal.signal(signum, handler)
+    return n
+
+
+def ProfileFileWorker(task):
+    """ProfileFileWorker: runs in a worker process, builds a private DataNode tree for one file or byte range"""
+
+    # task holds the keyword arguments of ProfileSample when it has a
+    # sampleSize, or of ProfileFile otherwise. With a cleanPath, the
+    # records are also written to that part file. The number of the
+    # last line read is handed back for FileOffsets.
+
+    task = dict(task)
+    task.pop('cacheKey', None)
+    task.pop('lastRange', None)
+    cleanPath = task.pop('cleanPath', None)
+    if cleanPath:
+        task['writer'] = CleanWriter(cleanPath)
+    convergeRecs = task.pop('convergeRecs')
+    convergeBytes = task.pop('convergeBytes')
+    if convergeRecs or convergeBytes:
+        task['monitor'] = ConvergenceMonitor(convergeRecs,
+                convergeBytes)
+    offsetDict = {}
+    task['FileOffsets'] = offsetDict
+    RootNode = DataNode('root')
+    if 'sampleSize' in task:
+        n = ProfileSample(RootNode, **task)
+    else:
+        n = ProfileFile(RootNode, **task)
+    if cleanPath:
+        task['writer'].Close()
+    return (PackTree(RootNode), n, TakeRunStats(),
+            offsetDict[task['inpath']][1])
+
+
+def ProfileFilesParallel(
+    RootNode,
+    FileLst,
+    table_name,
+    jobs,
+    sampler=1,
+    maxrecsperfile=None,
+    chunkBytes=None,
+    n=0,
+    FileOffsets=None,
+    checkpointEvery=None,
+    checkpoint=None,
+    monitor=None,
+    progress=None,
+    sampleSize=None,
+    seed=None,
+    cache=None,
+    writer=None,
+    ):
+    """ProfileFilesParallel: spreads FileLst over a pool of worker processes and merges their trees in file order"""
+
+    # Files larger than chunkBytes are cut into up to `jobs` byte ranges.
+    # A --limit applies to the first lines of a file, so limited files
+    # are never split. Results are merged in file and range order so that
+    # firstValue and first-seen ordering match a serial run. Merging in
+    # order also means the profiled part of each file is a prefix, which
+    # is what FileOffsets records for checkpoints. With a monitor, every
+    # range stops once its own schema converged, and no further results
+    # are merged once the merged schema converged. A sampleSize is
+    # allocated over files, then over ranges, in proportion to their size.
+    # With a cache, unchanged files are merged from it in their place,
+    # and the ranges of every other file are merged into a tree of its
+    # own that is cached before it is merged. With a writer, every range
+    # writes its records to a part file, handed to the writer as the
+    # range is merged. Every range is told the number of the line before
+    # it, counted while splitting, so that --sampler picks the same lines
+    # as a serial run.
+
+    numf = len(FileLst)
+    sizeLst = [os.path.getsize(inpath) for inpath in FileLst]
+    if sampleSize != None:
+        fileSampleLst = AllocateSample(sampleSize, sizeLst)
+    taskLst = []
+    for i in range(numf):
+        inpath = FileLst[i]
+        (start, l) = (0, 0)
+        if FileOffsets and inpath in FileOffsets:
+            if FileOffsets[inpath][2]:
+                continue
+            (start, l) = FileOffsets[inpath][:2]
+        cacheKey = None
+        if cache and start == 0:
+            cacheKey = cache.Key(inpath)
+            cached = cache.Load(cacheKey)
+            if cached != None:
+                print '%s: profile from cache' % inpath
+                taskLst.append({
+                    'inpath': inpath,
+                    'start': 0,
+                    'end': None,
+                    'cached': cached,
+                    })
+                continue
+        numChunks = 1
+        if chunkBytes and not maxrecsperfile:
+            numChunks = min(jobs, (sizeLst[i] - start) // chunkBytes)
+        rangeLst = SplitFile(inpath, numChunks, start)
+        if sampleSize != None:
+            rangeSampleLst = AllocateSample(fileSampleLst[i], [(end
+                    or sizeLst[i]) - start for (start, end) in
+                    rangeLst])
+        for j in range(len(rangeLst)):
+            (start, end) = rangeLst[j]
+            task = {
+                'inpath': inpath,
+                'table_name': table_name,
+                'f': i + 1,
+                'numf': numf,
+                'start': start,
+                'end': end,
+                'convergeRecs': monitor and monitor.windowRecs,
+                'convergeBytes': monitor and monitor.windowBytes,
+                }
+            if sampleSize != None:
+                if rangeSampleLst[j] == 0:
+                    continue
+                task['sampleSize'] = rangeSampleLst[j]
+                task['seed'] = seed
+            else:
+                task['sampler'] = sampler
+                task['maxrecsperfile'] = maxrecsperfile
+                task['l'] = l
+                if j < len(rangeLst) - 1:
+                    l += CountLines(inpath, start, end)
+            if cacheKey:
+                task['cacheKey'] = cacheKey
+                task['lastRange'] = j == len(rangeLst) - 1
+            taskLst.append(task)
+    partLst = []
+    if writer:
+        for task in taskLst:
+            (fd, task['cleanPath']) = \
+                tempfile.mkstemp(prefix='schema-discovery-',
+                                 suffix='.part',
+                                 dir=os.path.dirname(os.path.abspath(writer.outpath)))
+            os.close(fd)
+            partLst.append(task['cleanPath'])
+    lastCheckpoint = n
+    fileNode = None
+    pool = multiprocessing.Pool(processes=jobs)
+    try:
+        results = pool.imap(ProfileFileWorker, [task for task in
+                            taskLst if not 'cached' in task])
+        for task in taskLst:
+            if 'cached' in task:
+                (node, n_f) = task.pop('cached')
+                l = 0
+            else:
+                (packedLst, n_f, stats, l) = results.next()
+                MergeRunStats(stats)
+                node = UnpackTree(packedLst)
+                if writer:
+                    writer.AddFile(task['cleanPath'], n_f)
+            if task.get('cacheKey'):
+                if fileNode == None:
+                    (fileNode, fileN) = (DataNode('root'), 0)
+                fileNode.MergeChildren(node)
+                fileN += n_f
+                if not task['lastRange']:
+                    continue
+                if n + fileN <= MaxNumRecsToCount:
+                    cache.Store(task['cacheKey'], fileNode, fileN)
+                (node, n_f) = (fileNode, fileN)
+                fileNode = None
+            RootNode.MergeChildren(node)
+            n += n_f
+            if progress:
+                progress(n)
+            (inpath, start, end) = (task['inpath'], task['start'],
+                                    task['end'])
+            if end == None:
+                end = os.path.getsize(inpath)
+            if FileOffsets != None:
+                FileOffsets[inpath] = [end, l, end
+                        >= os.path.getsize(inpath)]
+            if checkpoint and n - lastCheckpoint >= checkpointEvery:
+                checkpoint(n)
+                lastCheckpoint = n
+            if monitor:
+                monitor.nbytes += end - start
+                if monitor.Converged(n, monitor.nbytes):
+                    break
+        if monitor and monitor.stopReason:
+            pool.terminate()
+        else:
+            pool.close()
+    except:
+        pool.terminate()
+        for partpath in partLst:
+            if os.path.exists(partpath):
+                os.remove(partpath)
+        raise
+    finally:
+        pool.join()
+    return n
+
 
 if __name__ == '__main__':
     if len(sys.argv) < 2:
@@ -1057,76 +4138,479 @@ if __name__ == '__main__':
     else:
         FileLst = [inpath]
     AttributesToLower_Case = ctx.attributes_to_lowercase
+    if ctx.decoder != 'auto':
+        decoderDict = dict(JsonDecoders)
+        if not ctx.decoder in decoderDict:
+            parser.error('JSON decoder %s is not installed' % ctx.decoder)
+        (JsonDecoderName, JsonLoads) = (ctx.decoder,
+                decoderDict[ctx.decoder])
+    ProgressEvery = float(ctx.progress_every)
+    if ProgressEvery > 0:
+        progress = ReportProgress
+    else:
+        progress = None
+    UnifyListElements = ctx.unify_list_elements
+    ValueSketches = not ctx.no_sketches
+    SpatialCellOrder = int(ctx.cell_order)
     table_name = ctx.table_name
     if ctx.limit:
         maxrecsperfile = int(ctx.limit)
     else:
         maxrecsperfile = None
     sampler = int(ctx.sampler)
+    jobs = int(ctx.jobs)
+    chunkBytes = int(float(ctx.chunk_size) * 1024 * 1024)
+    if ctx.checkpoint_every:
+        checkpointEvery = int(ctx.checkpoint_every)
+    else:
+        checkpointEvery = None
+    if ctx.ddl_every:
+        ddlEvery = int(ctx.ddl_every)
+    else:
+        ddlEvery = None
+    if ctx.ddl_seconds != None:
+        ddlSeconds = float(ctx.ddl_seconds)
+    else:
+        ddlSeconds = 10.0
+    streamLst = [inpath for inpath in FileLst if IsStream(inpath)]
+    if streamLst and (jobs > 1 or ctx.seek_sample or ctx.watch):
+        parser.error('--jobs, --seek_sample and --watch need regular files, not %s'
+                      % ', '.join(streamLst))
+    if streamLst and ctx.sample_size and (ctx.ddl_every
+            or ctx.ddl_seconds != None):
+        parser.error('--sample_size profiles the sample once the streams end and cannot be used with --ddl_every or --ddl_seconds'
+                     )
+    if ctx.cache_dir and (ctx.sample_size or ctx.seek_sample
+                          or ctx.watch or ctx.converge_records
+                          or ctx.converge_bytes):
+        parser.error('--cache_dir caches whole files and cannot be used with --sample_size, --seek_sample, --watch or --converge_*'
+                     )
+    if ctx.watch and (jobs > 1 or ctx.sample_size or ctx.seek_sample):
+        parser.error('--watch reads every record and cannot be used with --jobs, --sample_size or --seek_sample'
+                     )
+    if ctx.clean_output and (sampler > 1 or maxrecsperfile
+                             or ctx.sample_size or ctx.seek_sample
+                             or ctx.cache_dir or ctx.resume
+                             or ctx.from_profile or ctx.converge_records
+                             or ctx.converge_bytes):
+        parser.error('--clean_output writes every record as it is profiled and cannot be used with --sampler, --limit, --sample_size, --seek_sample, --cache_dir, --resume, --from_profile or --converge_*'
+                     )
+    if ctx.watch and ctx.feature_collection:
+        parser.error('--watch reads appended lines and cannot be used with --feature_collection'
+                     )
+    if ctx.feature_collection:
+        FeatureCollectionScanner = imp.load_source('geojson_to_sc',
+                os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                'geojson-to-sc.py')).FeatureScanner
+    if ctx.sample_size:
+        sampleSize = int(ctx.sample_size)
+    else:
+        sampleSize = None
+    if ctx.seek_sample:
+        seekSampleSize = int(ctx.seek_sample)
+    else:
+        seekSampleSize = None
+    if ctx.seed:
+        seed = int(ctx.seed)
+    else:
+        seed = random.SystemRandom().randint(0, 2 ** 31 - 1)
+    monitor = None
+    if ctx.converge_records or ctx.converge_bytes:
+        monitor = ConvergenceMonitor()
+        if ctx.converge_records:
+            monitor.windowRecs = int(ctx.converge_records)
+        if ctx.converge_bytes:
+            monitor.windowBytes = int(float(ctx.converge_bytes) * 1024
+                                      * 1024)
     schema_name = ctx.schema_name
+
+    root = 'root'
+    n = 0
+    RootNode = DataNode(root)
+    FileOffsets = {}
+    InodeOffsets = {}
+
+    # Records are always added under the table name of the run that
+    # started the profile, so a resumed run keeps growing the same node.
+
+    table_key = table_name
+    state_path = ctx.from_profile or ctx.resume
+    if state_path:
+        state = LoadProfile(state_path)
+        RootNode = state['RootNode']
+        n = state['n']
+        FileOffsets = state['FileOffsets']
+        InodeOffsets = state.get('InodeOffsets', {})
+        table_key = state['table_name']
+        UnifyListElements = state['UnifyListElements']
+        if not FileLst:
+            FileLst = state['FileLst']
+        if table_name == None:
+            table_name = table_key
+    profile_path = ctx.save_profile or ctx.resume
+    cache = None
+    if ctx.cache_dir:
+        cache = ProfileCache(ctx.cache_dir, int(float(ctx.cache_size)
+                             * 1024 * 1024), (table_key,
+                             UnifyListElements, SpatialCellOrder,
+                             ValueSketches,
+                             sampler, maxrecsperfile,
+                             ctx.feature_collection))
+    if checkpointEvery and not profile_path:
+        profile_path = '%s.profile' % (ctx.ofn or 'ddl_%s.sql'
+                % table_name)
+
     ddl_out_path = ctx.ofn
     if not ddl_out_path:
-        outUD = os.path.dirname(FileLst[0])
+        if FileLst:
+            outUD = os.path.dirname(FileLst[0])
+        else:
+            outUD = os.path.dirname(state_path)
         ddl_out_path = os.path.join(outUD, 'ddl_%s.sql' % table_name)
 
-    root = 'root'
+    writer = None
+    if ctx.clean_output:
+        writer = CleanWriter(ctx.clean_output)
+
+    def Checkpoint(n):
+        print 'Checkpoint: %i records saved to %s' % (n, profile_path)
+        SaveProfile(
+            profile_path,
+            RootNode,
+            n,
+            FileLst,
+            FileOffsets,
+            table_key,
+            InodeOffsets,
+            )
+
+    if checkpointEvery:
+        checkpoint = Checkpoint
+    else:
+        checkpoint = None
+
+    lastDDL = [None]
+
+    def UpdateDDL(n):
+
+        # Rolling DDL for stream input and --watch, written only when it
+        # changed. The DDL generation messages are only shown with
+        # --verbose. The records profiled so far go to the writer.
+
+        if writer:
+            writer.Flush()
+        t0 = time.time()
+        stdout = sys.stdout
+        if not Verbose:
+            sys.stdout = open(os.devnull, 'w')
+        try:
+            ddlStr = RootNode.GenerateDDL(schema_name, table_name,
+                    CleanUpInput=DDL_CleanUpInput)
+        finally:
+            if sys.stdout != stdout:
+                sys.stdout.close()
+                sys.stdout = stdout
+        RunStats['ddl'] += time.time() - t0
+        if ddlStr == lastDDL[0]:
+            return
+        lastDDL[0] = ddlStr
+        WriteDDL(ddl_out_path, ddlStr)
+        print 'DDL: %i records written to %s' % (n, ddl_out_path)
+
+    def WatchUpdate(n):
+        UpdateDDL(n)
+        if profile_path:
+            Checkpoint(n)
+
     numf = len(FileLst)
-    n = 0
-    f = 0
-    n_f = 0
-    RootNode = DataNode(root)
-    for inpath in FileLst:
-        n_f = 0
-        f += 1
-        print inpath
-        ifn = os.path.basename(inpath)
-        infp = fileinput.input(inpath)
-        l = 0
-        for line in infp:
-            n_f += 1
-            l += 1
-            if l % 1000 == 0:
-                print 'Files %s %i of %i total records processed %i ' \
-                    % (ifn, f, numf, n)
+    offsetLst = []
+    if ctx.from_profile:
+        pass
+    elif ctx.watch:
+        n = WatchFiles(
+            RootNode,
+            FileLst,
+            table_key,
+            float(ctx.watch),
+            InodeOffsets,
+            sampler=sampler,
+            maxrecsperfile=maxrecsperfile,
+            n=n,
+            update=WatchUpdate,
+            progress=progress,
+            writer=writer,
+            )
+    elif seekSampleSize != None:
 
-                # print line
-            # print "%imod%i %i"%(l, sampler, l%sampler)
+        # Seek sampling reads only a little of each file, so it runs in
+        # this process even with --jobs.
 
-            if l % sampler > 0:
+        fileSampleLst = AllocateSample(seekSampleSize,
+                [os.path.getsize(inpath) for inpath in FileLst])
+        for f in range(numf):
+            inpath = FileLst[f]
+            if FileOffsets.get(inpath, [0, 0, False])[2] \
+                or fileSampleLst[f] == 0:
                 continue
-            if n > MaxNumRecsToCount:
+            n = ProfileSeekSample(
+                RootNode,
+                inpath,
+                table_key,
+                fileSampleLst[f],
+                seed,
+                f=f + 1,
+                numf=numf,
+                n=n,
+                FileOffsets=FileOffsets,
+                monitor=monitor,
+                progress=progress,
+                offsetLst=offsetLst,
+                )
+            if monitor and monitor.stopReason:
                 break
-            if line == '\lf':
+        if ctx.offsets_path:
+            fp = open(ctx.offsets_path, 'w')
+            for (inpath, offset, lineStart) in offsetLst:
+                fp.write('%s\t%i\t%i\n' % (inpath, offset, lineStart))
+            fp.close()
+    elif jobs > 1:
+        n = ProfileFilesParallel(
+            RootNode,
+            FileLst,
+            table_key,
+            jobs,
+            sampler=sampler,
+            maxrecsperfile=maxrecsperfile,
+            chunkBytes=chunkBytes,
+            n=n,
+            FileOffsets=FileOffsets,
+            checkpointEvery=checkpointEvery,
+            checkpoint=checkpoint,
+            monitor=monitor,
+            progress=progress,
+            sampleSize=sampleSize,
+            seed=seed,
+            cache=cache,
+            writer=writer,
+            )
+    elif sampleSize != None and streamLst:
+        n = ProfileStreamSample(
+            RootNode,
+            FileLst,
+            table_key,
+            sampleSize,
+            seed,
+            n=n,
+            monitor=monitor,
+            progress=progress,
+            )
+    elif sampleSize != None:
+        fileSampleLst = AllocateSample(sampleSize,
+                [os.path.getsize(inpath) for inpath in FileLst])
+        for f in range(numf):
+            inpath = FileLst[f]
+            if FileOffsets.get(inpath, [0, 0, False])[2] \
+                or fileSampleLst[f] == 0:
                 continue
-            try:
-
-                # print '>>%s<<'%line[-2:]
-
-                line = line.replace(',  ]', ']')
-                if line[-2:] == ',\n':
-                    line = line[:-2]
-                jsonObj = json.loads(line)
-            except:
-                print '''Failed Reading this line %i of %i in %s:
->>%s<<
-''' \
-                    % (l, n, ifn, line)
+            n = ProfileSample(
+                RootNode,
+                inpath,
+                table_key,
+                fileSampleLst[f],
+                seed,
+                f=f + 1,
+                numf=numf,
+                n=n,
+                FileOffsets=FileOffsets,
+                monitor=monitor,
+                progress=progress,
+                )
+            if monitor and monitor.stopReason:
+                break
+    else:
+        f = 0
+        lastCheckpoint = n
+        for inpath in FileLst:
+            f += 1
+            if IsStream(inpath):
+                n = ProfileStream(
+                    RootNode,
+                    inpath,
+                    table_key,
+                    sampler=sampler,
+                    maxrecsperfile=maxrecsperfile,
+                    f=f,
+                    numf=numf,
+                    n=n,
+                    checkpointEvery=checkpointEvery,
+                    checkpoint=checkpoint,
+                    updateEvery=ddlEvery,
+                    updateSeconds=ddlSeconds,
+                    update=UpdateDDL,
+                    monitor=monitor,
+                    progress=progress,
+                    writer=writer,
+                    )
+                if monitor and monitor.stopReason:
+                    break
+                continue
+            (start, l, done) = FileOffsets.get(inpath, [0, 0, False])
+            if done:
                 continue
-            if maxrecsperfile and n_f > maxrecsperfile:
+            if cache and start == 0:
+
+                # Checkpoints fall between files: the file being read is
+                # only merged into RootNode once it is complete.
+
+                n = ProfileFileCached(
+                    cache,
+                    RootNode,
+                    inpath,
+                    table_key,
+                    sampler=sampler,
+                    maxrecsperfile=maxrecsperfile,
+                    f=f,
+                    numf=numf,
+                    n=n,
+                    FileOffsets=FileOffsets,
+                    progress=progress,
+                    )
+                if checkpoint and n - lastCheckpoint >= checkpointEvery:
+                    checkpoint(n)
+                    lastCheckpoint = n
+                continue
+            n = ProfileFile(
+                RootNode,
+                inpath,
+                table_key,
+                sampler=sampler,
+                maxrecsperfile=maxrecsperfile,
+                f=f,
+                numf=numf,
+                n=n,
+                start=start,
+                l=l,
+                FileOffsets=FileOffsets,
+                checkpointEvery=checkpointEvery,
+                checkpoint=checkpoint,
+                monitor=monitor,
+                progress=progress,
+                writer=writer,
+                )
+            if monitor and monitor.stopReason:
                 break
-            n += 1
-            RootNode.add(table_name, jsonObj)
-        infp.close()
+    if writer:
+        cleanN = writer.Close()
+    if profile_path and not ctx.from_profile:
+        Checkpoint(n)
 
     testOut = RootNode.export()
     FileLst_str = '\n'.join([fn for fn in FileLst])
     testOut = FileLst_str + '\n' + testOut
+    t0 = time.time()
     ddlStr = RootNode.GenerateDDL(schema_name, table_name,
                                   CleanUpInput=DDL_CleanUpInput)
+    RunStats['ddl'] += time.time() - t0
     print ddlStr
 
     print ddl_out_path
-    fp = open(ddl_out_path, 'w')
-    fp.write(ddlStr)
-    fp.close()
-
+    WriteDDL(ddl_out_path, ddlStr)
+
+    if monitor and monitor.stopReason:
+        stopReason = monitor.stopReason
+    elif n > MaxNumRecsToCount:
+        stopReason = 'record limit of %i reached' % MaxNumRecsToCount
+    elif ctx.watch:
+        stopReason = 'watch interrupted'
+    else:
+        stopReason = 'end of input'
+    print 'Records examined: %i' % n
+    runSeconds = time.time() - RunStart
+    if progress:
+        ReportProgress(n, force=True)
+    if RunStats['records'] and jobs > 1:
+
+        # Decode seconds are summed over the workers, so they are set
+        # against the workers' read, decode and add seconds summed the
+        # same way rather than the run time. Geometry seconds are part
+        # of add.
+
+        print 'Decoder %s: %i records, %.1f MB in %.2fs summed over workers (%.1f MB/s per worker), %.0f%% of summed worker time' \
+            % (
+            JsonDecoderName,
+            RunStats['records'],
+            RunStats['bytes'] / 1048576.0,
+            RunStats['decode'],
+            RunStats['bytes'] / 1048576.0 / max(RunStats['decode'],
+                    1e-9),
+            100.0 * RunStats['decode'] / max(RunStats['read']
+                    + RunStats['decode'] + RunStats['add'], 1e-9),
+            )
+    elif RunStats['records']:
+        print 'Decoder %s: %i records, %.1f MB in %.2fs (%.1f MB/s), %.0f%% of run time' \
+            % (
+            JsonDecoderName,
+            RunStats['records'],
+            RunStats['bytes'] / 1048576.0,
+            RunStats['decode'],
+            RunStats['bytes'] / 1048576.0 / max(RunStats['decode'],
+                    1e-9),
+            100.0 * RunStats['decode'] / max(runSeconds, 1e-9),
+            )
+    if jobs > 1:
+        print 'Stage seconds (summed over workers): %s' \
+            % ', '.join(['%s %.2f' % (k, RunStats[k]) for k in
+                        StageNames])
+    else:
+        print 'Stage seconds: %s' % ', '.join(['%s %.2f' % (k,
+                RunStats[k]) for k in StageNames])
+    (peakRSS, peakChildRSS) = PeakRSS()
+    nodeCount = RootNode.CountNodes()
+    print 'Run: %.2fs, %.0f records/s, %.1f MB/s, %i nodes, peak RSS %s KB' \
+        % (runSeconds, n / max(runSeconds, 1e-9), RunStats['read_bytes']
+           / 1048576.0 / max(runSeconds, 1e-9), nodeCount, peakRSS)
+    if jobs > 1:
+        print 'Peak worker RSS %s KB' % peakChildRSS
+    if seekSampleSize != None:
+        print 'Seek sample: %i records from %i offsets' % (n,
+                len(offsetLst))
+    if sampleSize != None or seekSampleSize != None:
+        print 'Sample seed: %i' % seed
+    if cache:
+        print 'Profile cache: %i of %i files from %s' % (cache.hits,
+                cache.hits + cache.misses, ctx.cache_dir)
+    if writer:
+        print 'Clean output: %i records written to %s' % (cleanN,
+                ctx.clean_output)
+    print 'Stop reason: %s' % stopReason
+
+    if ctx.stats_json:
+        stats = {
+            'records_examined': n,
+            'records_decoded': RunStats['records'],
+            'bytes_read': RunStats['read_bytes'],
+            'bytes_decoded': RunStats['bytes'],
+            'seconds': runSeconds,
+            'records_per_sec': n / max(runSeconds, 1e-9),
+            'bytes_per_sec': RunStats['read_bytes'] / max(runSeconds,
+                    1e-9),
+            'stage_seconds': dict([(k, RunStats[k]) for k in
+                                  StageNames]),
+            'peak_rss_kb': peakRSS,
+            'peak_worker_rss_kb': peakChildRSS,
+            'node_count': nodeCount,
+            'decoder': JsonDecoderName,
+            'jobs': jobs,
+            'files': FileLst,
+            'stop_reason': stopReason,
+            }
+        if cache:
+            stats['cache_hits'] = cache.hits
+            stats['cache_misses'] = cache.misses
+        if writer:
+            stats['records_written'] = cleanN
+        fp = open(ctx.stats_json, 'w')
+        json.dump(stats, fp, indent=2, sort_keys=True, separators=(',',
+                  ': '))
+        fp.write('\n')
+        fp.close()